@@ -2,19 +2,50 @@ import gradio as gr
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
+import logging
 
-# If you still need this (e.g., for future use)
-def get_income_expenses_data():
+from receipt_manifest import DEFAULT_USER_ID
+from receipt_store import receipt_store
+from relief_categories import NON_DEDUCTIBLE
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June',
+          'July', 'August', 'September', 'October', 'November', 'December']
+
+# Monthly expenses from the receipt store; income and empty stores use sample figures
+def get_income_expenses_data(user_id=DEFAULT_USER_ID, year=None):
+    year = year or datetime.now().year
+    expenses = [800, 900, 850, 950, 1000, 1100, 1200, 1250, 1300, 1400, 1500, 1600]
+    try:
+        monthly = receipt_store.totals_by_month(user_id, year)
+    except Exception as e:
+        logger.error("Failed to query receipt store: %s", e)
+        monthly = {}
+    if monthly:
+        expenses = [float(monthly.get(month, 0)) for month in range(1, 13)]
     return pd.DataFrame({
-        'Month': ['January', 'February', 'March', 'April', 'May', 'June',
-                  'July', 'August', 'September', 'October', 'November', 'December'],
+        'Month': MONTHS,
         'Income': [1200, 1300, 1400, 1500, 1600, 1700, 1800, 1900, 2000, 2100, 2200, 2300],
-        'Expenses': [800, 900, 850, 950, 1000, 1100, 1200, 1250, 1300, 1400, 1500, 1600],
-        'Year': [2024] * 12
+        'Expenses': expenses,
+        'Year': [year] * 12
     })
 
-# If you still need this
-def get_recent_transactions():
+# Recent receipts from the receipt store, or sample rows until any are confirmed
+def get_recent_transactions(user_id=DEFAULT_USER_ID, year=None, limit=10):
+    try:
+        rows = receipt_store.recent_transactions(user_id, year, limit=limit)
+    except Exception as e:
+        logger.error("Failed to query receipt store: %s", e)
+        rows = []
+    if rows:
+        return pd.DataFrame({
+            "No.": list(range(1, len(rows) + 1)),
+            "Date": [datetime.fromisoformat(row["date"]).strftime("%d/%m/%Y") if row["date"] else "" for row in rows],
+            "Expense Type": ["Non-Deductable" if row["relief"] in (None, NON_DEDUCTIBLE) else "Deductable" for row in rows],
+            "Expense Categories": [row["category"] or "" for row in rows],
+            "RM": ["" if row["total"] is None else f"{row['total']:.2f}" for row in rows]
+        })
     return pd.DataFrame({
         "No.": [1, 2, 3],
         "Date": ["20/04/2025", "05/04/2025", "25/04/2025"],
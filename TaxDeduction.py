@@ -1,14 +1,24 @@
 import gradio as gr
 import time
-from tax_relief_advisor import get_tax_summary, chat_with_context  # Import your backend functions
+from Profile import annual_income
+from chat_sessions import chat_sessions
+from log_utils import get_logger, log_event
+from tax_relief_advisor import get_tax_summary, stream_chat_with_context  # Import your backend functions
+from relief_engine import relief_breakdown, relief_claims, section_title
+from scheduler import INTERACTIVE, lane_options, scheduled
+from tax_calculator import SAMPLE_ANNUAL_INCOME, compute_tax
 
-# Global state for chatbot session
-session_state = {"session_id": None}
+logger = get_logger(__name__)
 
 # --- Tax Payable Scorecard ---
-def delayed_tax_scorecard():
-    time.sleep(2)  # Simulated delay
-    return "<div style='text-align:center; font-size:40px; font-weight:bold; color:#4caf50;'>RM 1,500.00</div>"
+def tax_scorecard():
+    income = annual_income() or SAMPLE_ANNUAL_INCOME
+    result = compute_tax(income, relief_claims())
+    return f"""
+    <div style='text-align:center; font-size:40px; font-weight:bold; color:#4caf50;'>RM {result.payable:,.2f}</div>
+    <p style='text-align:center; font-size:13px; color:#777;'>Chargeable income RM {result.chargeable_income:,.2f}
+    (income RM {result.income:,.2f} less reliefs RM {result.reliefs:,.2f})</p>
+    """
 
 # --- Relief Bar Renderer ---
 def render_relief_bar(label, claimed, max_value):
@@ -18,20 +28,59 @@ def render_relief_bar(label, claimed, max_value):
         <div style='background:#eee; border-radius:5px; width:100%; height:20px;'>
             <div style='background:#4caf50; width:{percent}%; height:100%; border-radius:5px;'></div>
         </div>
-        <p style="font-size:12px; margin-top:2px;">{label}: Claimed RM{claimed} / RM{max_value}</p>
+        <p style="font-size:12px; margin-top:2px;">{label}: Claimed RM{claimed:,.2f} / RM{max_value:,}</p>
     </div>
     """
 
+# --- Relief Breakdown ---
+def render_breakdown():
+    sections = []
+    for section, bars in relief_breakdown().items():
+        rendered = "".join(render_relief_bar(label, claimed, max_val) for label, claimed, max_val in bars)
+        sections.append(f"""
+    <details style='margin-bottom:8px;'>
+        <summary style='cursor:pointer; font-weight:bold;'>{section_title(section)}</summary>
+        {rendered}
+    </details>
+    """)
+    return "".join(sections)
+
 # --- Chat Handler ---
-def ui_chat(user_message, history):
-    response, session_id, error = chat_with_context(user_message, session_state["session_id"])
-    if error:
-        return history + [[user_message, f"⚠️ {error}"]]
-    session_state["session_id"] = session_id
-    return history + [[user_message, response]]
+# Each browser session keeps its own DashScope conversation. The answer is streamed
+# into the chat as it is generated; if the browser goes away Gradio closes this
+# generator, which cancels the upstream call.
+@scheduled("llm")
+def ui_chat(user_message, history, request: gr.Request):
+    session_key = request.session_hash if request else None
+    session_id = chat_sessions.get(session_key)
+    yield history + [[user_message, None]]
+
+    started = time.monotonic()
+    first_token = None
+    new_session_id = None
+    answers = stream_chat_with_context(user_message, session_id)
+    try:
+        for text, new_session_id, error in answers:
+            if error:
+                yield history + [[user_message, f"{text}\n\n⚠️ {error}" if text else f"⚠️ {error}"]]
+                return
+            if first_token is None and text:
+                first_token = time.monotonic() - started
+            yield history + [[user_message, text]]
+    finally:
+        answers.close()
+
+    chat_sessions.set(session_key, new_session_id)
+    log_event(logger, "chat.answer.done", first_token_ms=round((first_token or 0) * 1000),
+              total_ms=round((time.monotonic() - started) * 1000), new_session=session_id is None)
+    if session_id is None and new_session_id:
+        log_event(logger, "chat.session.start", **chat_sessions.stats())
+
+def end_chat_session(request: gr.Request):
+    chat_sessions.end(request.session_hash if request else None)
 
 # --- Main App ---
-def tax_summary():
+def tax_summary(refresh_on=()):
     with gr.Blocks(title="Malaysian Tax Assistant", theme=gr.themes.Soft()) as demo:
         gr.Markdown("""
         # 🇲🇾 Malaysian Tax Deduction Assistant
@@ -48,7 +97,10 @@ def tax_summary():
             with gr.Column(scale=1):
                 pass
 
-        demo.load(fn=delayed_tax_scorecard, inputs=[], outputs=tax_output)
+        demo.load(fn=tax_scorecard, inputs=[], outputs=tax_output, **lane_options(INTERACTIVE))
+        # Recompute only when its inputs change, e.g. a receipt is confirmed or income edited
+        for event in refresh_on:
+            event.then(fn=tax_scorecard, inputs=[], outputs=tax_output, **lane_options(INTERACTIVE))
 
         # --- AI Summary Section ---
         gr.Markdown("## 🧠 AI Tax Relief Summary")
@@ -70,8 +122,8 @@ def tax_summary():
             with gr.Column(scale=4):
                 pass
 
+        @scheduled("llm")
         def ui_get_summary():
-            time.sleep(2)  # Simulate delay
             summary, error = get_tax_summary()
             if error:
                 return f"<div style='color:red; font-weight:bold;'>⚠️ Error: {error}</div>"
@@ -82,59 +134,15 @@ def tax_summary():
         </div>
         """
 
-        summary_btn.click(fn=ui_get_summary, inputs=[], outputs=summary_output)
+        summary_btn.click(fn=ui_get_summary, inputs=[], outputs=summary_output, **lane_options("llm"))
 
         # --- Tax Relief Breakdown ---
         gr.Markdown("## 📊 Tax Relief Breakdown")
-        accordion_data = {
-            "👪 Self, Parents & Spouse": [
-                ("Automatic Individual Relief", 9000, 9000),
-                ("Medical Expenses For Parents", 4000, 8000),
-                ("Spouse/Alimony", 1000, 4000)
-            ],
-            "🎓 Education": [
-                ("Education Fees in Malaysia", 5000, 7000),
-                ("Upskilling/Self-Enhancement Courses", 1000, 2000)
-            ],
-            "🏥 Medical": [
-                ("Serious Disease/Vaccination", 6000, 8000),
-                ("Fertility Treatment", 0, 5000),
-                ("Medical & Mental Health Exam", 800, 1000),
-                ("Rehabilitation for Learning Disabilities", 0, 3000)
-            ],
-            "🎮 Lifestyle": [
-                ("Lifestyle Purchases", 2500, 2500),
-                ("Sports Activity Expenses", 300, 500),
-                ("EV Charging Equipment", 0, 2500)
-            ],
-            "👶 Parenthood": [
-                ("Breastfeeding Equipment", 1000, 1000),
-                ("Childcare Fees", 3000, 3000),
-                ("SSPN Deposit", 4000, 8000),
-                ("Child Relief", 2000, 2000),
-                ("Child 18+ in Full-Time Education", 0, 2000),
-                ("Child 18+ in Tertiary Education", 0, 8000)
-            ],
-            "💼 Insurance & Investment": [
-                ("Life Insurance (Non-Public Servants)", 3000, 3000),
-                ("EPF (Statutory & Voluntary)", 4000, 4000),
-                ("PRS & Deferred Annuity", 2500, 3000),
-                ("Education and Medical Insurance", 3000, 3000),
-                ("SOCSO", 250, 350)
-            ],
-            "♿ Disabled Persons": [
-                ("Equipment for Disabled", 0, 6000),
-                ("Disabled Individual", 0, 6000),
-                ("Disabled Spouse", 0, 5000),
-                ("Disabled Child", 0, 6000),
-                ("Disabled Child 18+ in Education/Training", 0, 8000)
-            ]
-        }
-
-        for section, bars in accordion_data.items():
-            with gr.Accordion(section, open=False):
-                for label, claimed, max_val in bars:
-                    gr.HTML(render_relief_bar(label, claimed, max_val))
+        breakdown_output = gr.HTML()
+
+        demo.load(fn=render_breakdown, inputs=[], outputs=breakdown_output, **lane_options(INTERACTIVE))
+        for event in refresh_on:
+            event.then(fn=render_breakdown, inputs=[], outputs=breakdown_output, **lane_options(INTERACTIVE))
 
         # --- Chatbot Section ---
         gr.Markdown("## 🤖 Ask About Your Tax Deductions")
@@ -142,7 +150,7 @@ def tax_summary():
         msg_input = gr.Textbox(placeholder="e.g. What documents do I need for education relief?", label="Your Question")
         send_btn = gr.Button("Send")
 
-        send_btn.click(fn=ui_chat, inputs=[msg_input, chatbot], outputs=chatbot)
-        msg_input.submit(fn=ui_chat, inputs=[msg_input, chatbot], outputs=chatbot)
+        send_btn.click(fn=ui_chat, inputs=[msg_input, chatbot], outputs=chatbot, **lane_options("llm"))
+        msg_input.submit(fn=ui_chat, inputs=[msg_input, chatbot], outputs=chatbot, **lane_options("llm"))
 
         return demo
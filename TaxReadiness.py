@@ -1,4 +1,11 @@
 import gradio as gr
+import logging
+
+from receipt_store import receipt_store
+from scheduler import INTERACTIVE, lane_options, scheduled
+from thumbnails import get_thumbnail, load_original
+
+logger = logging.getLogger(__name__)
 
 # --- Checklist items ---
 checklist_items = [
@@ -60,23 +67,60 @@ def get_dummy_expense_categories():
         "Medical": []
     }
 
+# --- Confirmed receipts per category as (image key, local path), falling back to the dummy data ---
+def get_expense_categories():
+    try:
+        categories = receipt_store.images_by_category()
+    except Exception as e:
+        logger.error("Failed to query receipt store: %s", e)
+        categories = {}
+    if categories:
+        return categories
+    return {category: [(path, path) for path in paths] for category, paths in get_dummy_expense_categories().items()}
+
+# --- Galleries show cached thumbnails; the original only loads when a tile is clicked ---
+def gallery_thumbnails(receipts):
+    """(thumbnails, receipts shown), dropping receipts without a thumbnail so tile indexes stay aligned"""
+    thumbnails, shown = [], []
+    for key, path in receipts:
+        thumb = get_thumbnail(key, path)
+        if thumb:
+            thumbnails.append(thumb)
+            shown.append((key, path))
+    return thumbnails, shown
+
+@scheduled("io")
+def show_original(receipts, evt: gr.SelectData):
+    key, path = receipts[evt.index]
+    try:
+        return gr.Image(value=load_original(key, path), visible=True)
+    except Exception as e:
+        logger.error("Failed to load receipt image %s: %s", key, e)
+        return gr.Image(value=None, visible=False)
+
+def render_receipt_gallery(receipts):
+    thumbnails, receipts = gallery_thumbnails(receipts)
+    gallery = gr.Gallery(
+        value=thumbnails,
+        columns=3,
+        object_fit="contain",
+        height=150,
+        allow_preview=False
+    )
+    original = gr.Image(label="Receipt", type="filepath", interactive=False, visible=False)
+    gallery.select(fn=show_original, inputs=gr.State(receipts), outputs=original, **lane_options("io"))
+    return gallery
+
 # --- Expenses & receipts categorisations and organisation rendering ---
 def render_expense_breakdown():
-    data = get_dummy_expense_categories()
+    data = get_expense_categories()
     components = []
 
     for category, receipts in data.items():
         with gr.Accordion(label=f"📁 {category}", open=False):
             if receipts:
                 components.append(gr.Markdown(f"### {category} Receipts"))
-                components.append(
-                    gr.Gallery(
-                        value=receipts,
-                        columns=3,
-                        object_fit="contain",
-                        height=150
-                    )
-                )
+                components.append(render_receipt_gallery(receipts))
             else:
                 components.append(gr.Markdown("_No receipts uploaded for this category._"))
 
@@ -119,19 +163,20 @@ def tax_readiness_feat():
             readiness_checklist.change(
                 fn=update_progress,
                 inputs=readiness_checklist,
-                outputs=[progress, progress_msg]
+                outputs=[progress, progress_msg],
+                **lane_options(INTERACTIVE)
             )
 
         # View expenses categorisation
         gr.Markdown("### 🧾 Categorised Expenses & Receipts")
 
-        categories = get_dummy_expense_categories()
+        categories = get_expense_categories()
 
     for cat, receipts in categories.items():
         with gr.Accordion(label=f"📁 {cat}", open=False):
             if receipts:
                 gr.Markdown(f"**{len(receipts)} receipt(s) found**")
-                gr.Gallery(value=receipts, columns=3, object_fit="contain", height=150)
+                render_receipt_gallery(receipts)
             else:
                 gr.Markdown("_No receipts uploaded for this category._")
 
@@ -3,71 +3,140 @@ import time
 import mimetypes
 import os
 from PIL import Image
-from receipt_parser import parse_receipt_qwen
-import logging
-import oss2
+from receipt_parser import parse_receipt_qwen, stream_receipt_qwen
+from oss_store import get_bucket, upload_objects
+from receipt_manifest import DEFAULT_USER_ID, receipt_year, record_receipt
+from receipt_store import receipt_store
+from relief_engine import relief_ledger
+from scheduler import INTERACTIVE, lane_options, scheduled
+from tax_relief_advisor import refresh_tax_summary
+from upload_spool import UploadSpool
+from thumbnails import get_thumbnail
+from duplicate_index import DuplicateReceiptError, check_and_add, check_duplicate, duplicate_index, image_hash_file
 from dotenv import load_dotenv
 import json
 from datetime import datetime
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from log_utils import Payload, capture_payload, configure_logging, get_logger, log_event
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+configure_logging()
+logger = get_logger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Configure OSS
-access_key_id = os.getenv('OSS_ACCESS_KEY_ID')
-access_key_secret = os.getenv('OSS_ACCESS_KEY_SECRET')
-endpoint = os.getenv('OSS_ENDPOINT')
-bucket_name = os.getenv('OSS_BUCKET_NAME')
+# Shared worker pool for batch scans, so concurrent batches cannot exceed the limit
+BATCH_CONCURRENCY = int(os.getenv('RECEIPT_BATCH_CONCURRENCY', '4'))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="receipt-batch")
+
+# Stream Qwen-VL output into the edit form as fields are decoded
+STREAM_PARSING = os.getenv('RECEIPT_STREAMING', '1') == '1'
+
+# Return from confirmation once the receipt is journaled, uploading to OSS in the background
+WRITE_BEHIND = os.getenv('RECEIPT_WRITE_BEHIND', '1') == '1'
+
+def receipt_keys(user_id, receipt_id, uploaded_at):
+    """OSS keys of a receipt's image and data objects"""
+    timestamp = uploaded_at.strftime("%Y%m%d_%H%M%S")
+    return (f"receipts/{user_id}/images/{timestamp}_{receipt_id}.jpg",
+            f"receipts/{user_id}/data/{timestamp}_{receipt_id}.json")
+
+def store_receipt(file_path, receipt_data, user_id=DEFAULT_USER_ID, receipt_id=None, uploaded_at=None):
+    """
+    Upload receipt image and data to OSS and index it in the user's manifest.
+    Raises on failure. Passing the same receipt_id and uploaded_at again
+    rewrites the same objects, so retries are safe.
+    """
+    # Shared, pooled OSS client (or the local stand-in when OSS_LOCAL_DIR is set)
+    bucket = get_bucket()
+    
+    # Generate unique ID for this receipt
+    receipt_id = receipt_id or str(uuid.uuid4())
+    uploaded_at = uploaded_at or datetime.now()
+    
+    # Never store (or count towards relief) the same receipt twice; a receipt already claimed
+    # under this receipt_id (both confirmation paths claim it first) passes
+    image_hash = image_hash_file(file_path)
+    receipt_id = check_and_add(user_id, receipt_id, image_hash, receipt_data)
+    
+    image_key, data_key = receipt_keys(user_id, receipt_id, uploaded_at)
+    receipt_data['image_key'] = image_key
+    receipt_data['data_key'] = data_key
+    receipt_data['upload_timestamp'] = uploaded_at.strftime("%Y%m%d_%H%M%S")
+    receipt_data['receipt_id'] = receipt_id
+    receipt_data['user_id'] = user_id
+    
+    # Upload image and receipt data concurrently (large images go multipart)
+    upload_objects(bucket, files=[(image_key, file_path)], objects=[(data_key, json.dumps(receipt_data))])
+    
+    # Galleries show this instead of the original
+    get_thumbnail(image_key, file_path)
+    
+    # The receipt is stored either way; a missing index row is logged, not fatal
+    try:
+        record_receipt(user_id, receipt_data, receipt_id, image_key, data_key, uploaded_at)
+    except Exception as e:
+        logger.error("Failed to index receipt %s in manifest: %s", receipt_id, e)
+    
+    log_event(logger, "receipt.upload.done", receipt_id=receipt_id)
+    return receipt_id
 
-def upload_to_oss(file_path, receipt_data):
+def upload_to_oss(file_path, receipt_data, user_id=DEFAULT_USER_ID, receipt_id=None, uploaded_at=None):
     """Upload receipt image and data to OSS"""
     try:
-        # Initialize OSS client
-        auth = oss2.Auth(access_key_id, access_key_secret)
-        bucket = oss2.Bucket(auth, endpoint, bucket_name)
-        
-        # Generate unique ID for this receipt
-        receipt_id = str(uuid.uuid4())
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Upload image
-        image_key = f"receipts/images/{timestamp}_{receipt_id}.jpg"
-        with open(file_path, 'rb') as f:
-            bucket.put_object(image_key, f)
-            
-        # Upload receipt data
-        data_key = f"receipts/data/{timestamp}_{receipt_id}.json"
-        receipt_data['image_key'] = image_key
-        receipt_data['upload_timestamp'] = timestamp
-        receipt_data['receipt_id'] = receipt_id
-        
-        bucket.put_object(data_key, json.dumps(receipt_data))
-        
-        logger.info(f"Successfully uploaded receipt {receipt_id} to OSS")
-        return True, receipt_id
-        
+        receipt_id = check_and_add(user_id, receipt_id or str(uuid.uuid4()), image_hash_file(file_path), receipt_data)
+    except Exception as e:
+        logger.error("Failed to upload to OSS: %s", e)
+        return False, str(e)
+    try:
+        return True, store_receipt(file_path, receipt_data, user_id, receipt_id, uploaded_at)
     except Exception as e:
-        logger.error(f"Failed to upload to OSS: {str(e)}")
+        # Not stored, so confirming the receipt again must not be rejected as a duplicate.
+        # Spool retries call store_receipt directly and keep their claim until the spool gives up.
+        duplicate_index.mark_failed(user_id, receipt_id)
+        logger.error("Failed to upload to OSS: %s", e)
         return False, str(e)
 
+def find_scanned_duplicate(path, user_id=DEFAULT_USER_ID):
+    """Error message if this image is already stored, checked before paying for a parse"""
+    try:
+        check_duplicate(user_id, image_hash=image_hash_file(path))
+    except DuplicateReceiptError as e:
+        return str(e)
+    except Exception as e:
+        logger.warning("Duplicate check skipped for %s: %s", os.path.basename(path), e)
+    return None
+
+def release_failed_upload(job):
+    """Let a receipt the spool gave up on be confirmed again instead of rejected as a duplicate"""
+    duplicate_index.mark_failed(job["user_id"], job["receipt_id"])
+
+# Confirmed receipts are journaled locally and uploaded in the background
+upload_spool = UploadSpool(store_receipt, on_give_up=release_failed_upload)
+
 def process_receipt(file):
     """Process a single receipt file and return parsed data"""
     try:
-        logger.info(f"Processing receipt file: {file.name}")
+        log_event(logger, "receipt.process.start", file=os.path.basename(file.name))
+        
+        duplicate = find_scanned_duplicate(file.name)
+        if duplicate:
+            return file, {"error": duplicate}
         
+        # Read the raw bytes once so identical uploads hit the parse cache
+        with open(file.name, 'rb') as f:
+            image_bytes = f.read()
+
         # Open image with PIL
         image = Image.open(file.name)
-        logger.info(f"Successfully opened image: {image.size}, {image.mode}")
+        log_event(logger, "receipt.process.opened", size=image.size, mode=image.mode, bytes=len(image_bytes))
         
         # Parse receipt
-        logger.info("Calling parse_receipt_qwen...")
-        parsed_data = parse_receipt_qwen(image)
-        logger.info(f"Parsed data received: {parsed_data}")
+        parsed_data = parse_receipt_qwen(image, image_bytes=image_bytes)
+        capture_payload(logger, "receipt.process.parsed", parsed_data)
         
         if not parsed_data:
             logger.error("Parsed data is empty")
@@ -75,15 +144,44 @@ def process_receipt(file):
             
         return file, parsed_data
     except Exception as e:
-        logger.error(f"Error processing receipt: {str(e)}", exc_info=True)
+        logger.error("Error processing receipt: %s", e, exc_info=True)
         return file, {"error": f"Failed to parse receipt: {str(e)}"}
 
+def process_receipt_stream(file):
+    """Process a single receipt file, yielding (file, parsed_data, done) as fields arrive"""
+    try:
+        log_event(logger, "receipt.process.start", file=os.path.basename(file.name), stream=True)
+        
+        duplicate = find_scanned_duplicate(file.name)
+        if duplicate:
+            yield file, {"error": duplicate}, True
+            return
+        
+        with open(file.name, 'rb') as f:
+            image_bytes = f.read()
+        image = Image.open(file.name)
+        
+        for parsed_data, done in stream_receipt_qwen(image, image_bytes=image_bytes):
+            yield file, parsed_data, done
+    except Exception as e:
+        logger.error("Error processing receipt: %s", e, exc_info=True)
+        yield file, {"error": f"Failed to parse receipt: {str(e)}"}, True
+
+def process_receipts_batch(files):
+    """Parse many receipt files on the shared worker pool, yielding (file, parsed_data) as each finishes"""
+    futures = [batch_executor.submit(process_receipt, file) for file in files]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Drop receipts that have not started yet if the caller stops listening
+        for future in futures:
+            future.cancel()
+
 def format_receipt_info(parsed_data):
     """Format parsed receipt data into a readable string"""
-    logger.info(f"Formatting receipt info from data: {parsed_data}")
-    
     if "error" in parsed_data:
-        logger.error(f"Error in parsed data: {parsed_data['error']}")
+        logger.error("Error in parsed data: %s", Payload(parsed_data["error"]))
         return parsed_data["error"]
     
     info = []
@@ -95,10 +193,6 @@ def format_receipt_info(parsed_data):
     prices = parsed_data.get('Item price', [])
     categories = parsed_data.get('Item category', [])
     
-    logger.info(f"Raw items: {items}")
-    logger.info(f"Raw prices: {prices}")
-    logger.info(f"Raw categories: {categories}")
-    
     info.append("\n📝 Items:")
     if len(items) > 0:
         for i in range(len(items)):
@@ -112,7 +206,7 @@ def format_receipt_info(parsed_data):
     info.append(f"\n💰 Total Amount: {parsed_data.get('Total amount spent', 'N/A')}")
     
     formatted_info = "\n".join(info)
-    logger.info(f"Formatted receipt info: {formatted_info}")
+    capture_payload(logger, "receipt.format.done", formatted_info)
     return formatted_info
 
 def update_receipt_info(parsed_data, merchant, date, items, prices, categories, total):
@@ -125,10 +219,13 @@ def update_receipt_info(parsed_data, merchant, date, items, prices, categories,
         "Item category": categories.split("\n") if categories else [],
         "Total amount spent": total
     }
-    logger.info(f"Updated receipt data: {updated_data}")
+    capture_payload(logger, "receipt.edit.updated", updated_data)
     return updated_data
 
 def upload_receipt_feature():
+    # Resume uploads left in the spool by a previous run
+    upload_spool.start()
+    
     with gr.Blocks() as uploadreceipt_feat:
         gr.Markdown("## 📤 Receipt Scanner and Information Extractor")
         gr.Markdown("Upload your receipt image to extract information. Supported formats: PNG, JPG, JPEG")
@@ -174,67 +271,134 @@ def upload_receipt_feature():
                     
                     confirm_btn = gr.Button("✅ Confirm Information", variant="secondary")
         
+        # Batch scanning for many receipts at once
+        gr.Markdown("### 📚 Batch Scan")
+        gr.Markdown("Upload several receipts to scan them in parallel. Select a row to review and confirm it.")
+        with gr.Row():
+            with gr.Column(scale=1):
+                batch_input = gr.Files(
+                    label="Upload Receipts",
+                    file_types=["image"],
+                    file_count="multiple"
+                )
+                batch_scan_btn = gr.Button("🔍 Scan All Receipts", variant="primary")
+            with gr.Column(scale=2):
+                batch_status = gr.Markdown("")
+                batch_table = gr.Dataframe(
+                    headers=["File", "Merchant", "Date", "Total", "Items", "Status"],
+                    datatype=["str", "str", "str", "str", "number", "str"],
+                    interactive=False
+                )
+
         # Store parsed data state and file path
         parsed_data_state = gr.State({})
         file_path_state = gr.State("")
+        batch_results_state = gr.State([])
+        
+        def edit_form_values(file_path, parsed_data, status):
+            """Build the handle_upload outputs that load a parsed receipt into the edit form"""
+            formatted_info = format_receipt_info(parsed_data)
+            
+            # Handle items, prices, and categories
+            items = parsed_data.get("Item name", [])
+            prices = parsed_data.get("Item price", [])
+            categories = parsed_data.get("Item category", [])
+            
+            # Convert to strings for display
+            items_str = "\n".join(str(item) for item in items)
+            prices_str = "\n".join(str(price) for price in prices)
+            categories_str = "\n".join(str(cat) for cat in categories)
+            total = str(parsed_data.get("Total amount spent", ""))
+            
+            return (
+                file_path,  # Preview
+                status,  # Status
+                formatted_info,   # Extracted info
+                gr.Group(visible=True),  # Show edit group
+                parsed_data,     # Store parsed data
+                file_path,  # Store file path
+                parsed_data.get("Merchant name", ""),
+                parsed_data.get("Date of purchase", ""),
+                items_str,
+                prices_str,
+                categories_str,
+                total
+            )
         
+        @scheduled("vlm")
         def handle_upload(file):
-            """Handle receipt upload and initial parsing"""
+            """Handle receipt upload and initial parsing, streaming fields into the edit form"""
             try:
                 if not file:
-                    return None, "Please upload a receipt image.", None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
+                    yield None, "Please upload a receipt image.", None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
+                    return
                 
-                logger.info(f"Processing uploaded file: {file}")
-                image_file, parsed_data = process_receipt(file)
-                
-                if "error" in parsed_data:
-                    return None, parsed_data["error"], None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
-                
-                formatted_info = format_receipt_info(parsed_data)
-                
-                # Handle items, prices, and categories
-                items = parsed_data.get("Item name", [])
-                prices = parsed_data.get("Item price", [])
-                categories = parsed_data.get("Item category", [])
-                
-                # Convert to strings for display
-                items_str = "\n".join(str(item) for item in items)
-                prices_str = "\n".join(str(price) for price in prices)
-                categories_str = "\n".join(str(cat) for cat in categories)
-                total = str(parsed_data.get("Total amount spent", ""))
+                if STREAM_PARSING:
+                    results = process_receipt_stream(file)
+                else:
+                    results = [(*process_receipt(file), True)]
                 
-                return (
-                    image_file.name,  # Preview
-                    "✅ Receipt processed successfully!",  # Status
-                    formatted_info,   # Extracted info
-                    gr.Group(visible=True),  # Show edit group
-                    parsed_data,     # Store parsed data
-                    image_file.name,  # Store file path
-                    parsed_data.get("Merchant name", ""),
-                    parsed_data.get("Date of purchase", ""),
-                    items_str,
-                    prices_str,
-                    categories_str,
-                    total
-                )
+                for image_file, parsed_data, done in results:
+                    if "error" in parsed_data:
+                        yield None, parsed_data["error"], None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
+                        return
+                    
+                    status = "✅ Receipt processed successfully!" if done else "⏳ Reading receipt..."
+                    yield edit_form_values(image_file.name, parsed_data, status)
             except Exception as e:
-                logger.error(f"Error in handle_upload: {str(e)}", exc_info=True)
-                return None, f"Error processing receipt: {str(e)}", None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
+                logger.error("Error in handle_upload: %s", e, exc_info=True)
+                yield None, f"Error processing receipt: {str(e)}", None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
         
+        @scheduled("io")
         def handle_confirmation(parsed_data, file_path, merchant, date, items, prices, categories, total):
             """Handle confirmation of receipt information and upload to OSS"""
             try:
                 # Update receipt data with confirmed information
                 updated_data = update_receipt_info(parsed_data, merchant, date, items, prices, categories, total)
                 
-                # Upload to OSS
-                success, result = upload_to_oss(file_path, updated_data)
+                receipt_id = str(uuid.uuid4())
+                uploaded_at = datetime.now()
+                if WRITE_BEHIND:
+                    try:
+                        # Reject duplicates now, claiming the receipt in the same step so a concurrent
+                        # confirmation cannot pass too; a receipt whose upload failed is retried under its id
+                        image_hash = image_hash_file(file_path)
+                        receipt_id = check_and_add(DEFAULT_USER_ID, receipt_id, image_hash, updated_data)
+                        # Journal to local disk; the spool uploads to OSS with retries
+                        try:
+                            upload_spool.enqueue(file_path, updated_data, DEFAULT_USER_ID, receipt_id, uploaded_at)
+                        except Exception:
+                            duplicate_index.mark_failed(DEFAULT_USER_ID, receipt_id)
+                            raise
+                        success, result = True, receipt_id
+                    except DuplicateReceiptError as e:
+                        success, result = False, str(e)
+                else:
+                    # Upload to OSS
+                    success, result = upload_to_oss(file_path, updated_data, receipt_id=receipt_id, uploaded_at=uploaded_at)
+                    if success:
+                        receipt_id = result
                 
                 if success:
+                    # Keep a local, queryable copy for the dashboard and tax views
+                    image_key, data_key = receipt_keys(DEFAULT_USER_ID, receipt_id, uploaded_at)
+                    try:
+                        receipt_store.add_receipt(updated_data, receipt_id, image_path=file_path,
+                                                  image_key=image_key, data_key=data_key, uploaded_at=uploaded_at)
+                        year = receipt_year(updated_data, uploaded_at)
+                        relief_ledger.add_receipt(DEFAULT_USER_ID, year, receipt_id, updated_data)
+                        # Have the AI summary for the new expense figures ready before it is asked for;
+                        # the Summary button only shows the current year
+                        if year == datetime.now().year:
+                            refresh_tax_summary(DEFAULT_USER_ID, year)
+                    except Exception as e:
+                        logger.error("Failed to save receipt %s locally: %s", receipt_id, e)
+                    
                     # Show success popup
-                    gr.Info("Receipt information uploaded successfully!")
+                    gr.Info("Receipt saved! Uploading in the background." if WRITE_BEHIND
+                            else "Receipt information uploaded successfully!")
                     return (
-                        "✅ Receipt uploaded successfully!",  # status message
+                        "✅ Receipt saved!" if WRITE_BEHIND else "✅ Receipt uploaded successfully!",  # status message
                         "",  # clear extracted info
                         {},  # clear parsed data state
                         gr.Group(visible=False),  # hide edit group
@@ -264,7 +428,7 @@ def upload_receipt_feature():
                     )
                     
             except Exception as e:
-                logger.error(f"Error in handle_confirmation: {str(e)}", exc_info=True)
+                logger.error("Error in handle_confirmation: %s", e, exc_info=True)
                 # Show error popup
                 gr.Error(f"Error updating information: {str(e)}")
                 return (
@@ -281,6 +445,44 @@ def upload_receipt_feature():
                     total
                 )
         
+        @scheduled("vlm")
+        def handle_batch_upload(files):
+            """Scan many receipts concurrently, streaming each row into the table as it finishes"""
+            if not files:
+                yield "Please upload one or more receipt images.", [], []
+                return
+            
+            results = []
+            rows = []
+            started = time.perf_counter()
+            for image_file, parsed_data in process_receipts_batch(files):
+                failed = "error" in parsed_data
+                results.append((image_file.name, parsed_data))
+                rows.append([
+                    os.path.basename(image_file.name),
+                    parsed_data.get("Merchant name", ""),
+                    parsed_data.get("Date of purchase", ""),
+                    str(parsed_data.get("Total amount spent", "")),
+                    len(parsed_data.get("Item name", [])),
+                    f"❌ {parsed_data['error']}" if failed else "✅ Ready to confirm"
+                ])
+                elapsed = time.perf_counter() - started
+                yield f"⏳ Scanned {len(rows)}/{len(files)} receipts ({elapsed:.1f}s)", rows, results
+            
+            elapsed = time.perf_counter() - started
+            yield f"✅ Scanned {len(rows)} receipts in {elapsed:.1f}s", rows, results
+        
+        def handle_batch_select(results, evt: gr.SelectData):
+            """Load the selected batch result into the edit form"""
+            row = evt.index[0] if isinstance(evt.index, (list, tuple)) else evt.index
+            if row is None or row >= len(results):
+                return gr.update(), "", gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update(), gr.update()
+            
+            file_path, parsed_data = results[row]
+            if "error" in parsed_data:
+                return None, parsed_data["error"], None, gr.Group(visible=False), {}, "", "", "", "", "", "", ""
+            return edit_form_values(file_path, parsed_data, f"✏️ Reviewing {os.path.basename(file_path)}")
+        
         # Add a hidden component for navigation
         nav_state = gr.State(value=0)
         
@@ -301,11 +503,40 @@ def upload_receipt_feature():
                 prices_input,
                 categories_input,
                 total_input
-            ]
+            ],
+            **lane_options("vlm")
+        )
+        
+        # Connect batch scan button and row selection
+        batch_scan_btn.click(
+            fn=handle_batch_upload,
+            inputs=[batch_input],
+            outputs=[batch_status, batch_table, batch_results_state],
+            **lane_options("vlm")
+        )
+        
+        batch_table.select(
+            fn=handle_batch_select,
+            inputs=[batch_results_state],
+            outputs=[
+                image_preview,
+                status_message,
+                extracted_info,
+                edit_group,
+                parsed_data_state,
+                file_path_state,
+                merchant_input,
+                date_input,
+                items_input,
+                prices_input,
+                categories_input,
+                total_input
+            ],
+            **lane_options(INTERACTIVE)
         )
         
         # Connect confirm button
-        confirm_btn.click(
+        receipt_confirmed = confirm_btn.click(
             fn=handle_confirmation,
             inputs=[
                 parsed_data_state,
@@ -329,7 +560,8 @@ def upload_receipt_feature():
                 prices_input,
                 categories_input,
                 total_input
-            ]
+            ],
+            **lane_options("io")
         )
         
-        return uploadreceipt_feat
\ No newline at end of file
+        return uploadreceipt_feat, receipt_confirmed
\ No newline at end of file
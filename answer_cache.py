@@ -0,0 +1,118 @@
+# answer_cache.py
+
+import logging
+import os
+import re
+import threading
+import unicodedata
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, TfidfVectorizer
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity (character n-gram TF-IDF) a question needs to reuse a cached answer
+CHAT_CACHE_THRESHOLD = float(os.getenv('CHAT_CACHE_THRESHOLD', '0.85'))
+CHAT_CACHE_TTL = float(os.getenv('CHAT_CACHE_TTL', str(7 * 24 * 3600)))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv('CHAT_CACHE_MAX_ENTRIES', '1000'))
+
+
+def normalize_question(question):
+    """Lowercase, strip punctuation and collapse whitespace"""
+    text = unicodedata.normalize("NFKC", question or "").lower()
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def _stem(word):
+    for suffix in ("ing", "ed", "s"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def content_words(normalized):
+    return {_stem(word) for word in normalized.split() if word not in ENGLISH_STOP_WORDS}
+
+
+class _QuestionIndex:
+    """TF-IDF index over the cached questions of one namespace, rebuilt when questions are added"""
+
+    def __init__(self, questions):
+        self.questions = list(questions)
+        self.words = [content_words(question) for question in self.questions]
+        self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 5), sublinear_tf=True)
+        self.matrix = self.vectorizer.fit_transform(self.questions)
+
+    def closest(self, normalized):
+        """(question, score) of the closest cached question, or (None, 0.0)"""
+        scores = (self.matrix @ self.vectorizer.transform([normalized]).T).toarray().ravel()
+        best = int(scores.argmax())
+        # Similar wording is not enough: "limit for SSPN relief" must not reuse the EPF answer
+        if not content_words(normalized) <= self.words[best]:
+            return None, 0.0
+        return self.questions[best], float(scores[best])
+
+
+class AnswerCache:
+    """
+    Answers to first-turn chat questions, matched by normalised text first
+    and then by lexical similarity. Entries expire after ttl seconds and are
+    grouped by namespace (knowledge base ids and prompt context), so a
+    knowledge base update can drop exactly the answers built from it.
+    """
+
+    def __init__(self, threshold=CHAT_CACHE_THRESHOLD, ttl=CHAT_CACHE_TTL, max_entries=CHAT_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self._answers = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.similar_hits = 0
+
+    def get(self, question, namespace):
+        """Cached answer for question, or None"""
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        answer = self._answers.get((namespace, normalized))
+        if answer is not None:
+            return answer
+        with self._lock:
+            index = self._indexes.get(namespace)
+        if index is None:
+            return None
+        match, score = index.closest(normalized)
+        if match is None or score < self.threshold:
+            return None
+        answer = self._answers.get((namespace, match))
+        if answer is not None:
+            self.similar_hits += 1
+            logger.debug("Chat cache: %r answered as %r (%.2f)", normalized, match, score)
+        return answer
+
+    def put(self, question, answer, namespace):
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return
+        self._answers.put((namespace, normalized), answer)
+        with self._lock:
+            # Rebuild from the live entries, which also drops expired and evicted questions
+            questions = [key[1] for key in self._answers.keys() if key[0] == namespace]
+            self._indexes[namespace] = _QuestionIndex(questions)
+
+    def invalidate(self, knowledge_base_id=None):
+        """Drop cached answers built from a knowledge base (all of them when no id is given)"""
+        with self._lock:
+            stale = [ns for ns in self._indexes if knowledge_base_id is None or knowledge_base_id in ns[0]]
+            for namespace in stale:
+                del self._indexes[namespace]
+            for key in self._answers.keys():
+                if key[0] in stale:
+                    self._answers.pop(key)
+        logger.info("Chat cache invalidated for %s", knowledge_base_id or "all knowledge bases")
+
+    def stats(self):
+        return {**self._answers.stats(), "similar_hits": self.similar_hits}
+
+
+answer_cache = AnswerCache()
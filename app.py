@@ -2,8 +2,9 @@ import gradio as gr
 from Dashboard import create_dashboard
 from Profile import create_profile
 from UploadReceipt import upload_receipt_feature
-from TaxDeduction import tax_summary
+from TaxDeduction import end_chat_session, tax_summary
 from TaxReadiness import tax_readiness_feat
+from scheduler import APP_QUEUE_MAX_SIZE, thread_budget
 
 
 with gr.Blocks() as app:        
@@ -14,18 +15,23 @@ with gr.Blocks() as app:
     </div>
     """)
     with gr.Tab("Profile"):
-        create_profile()
+        _, income_updated = create_profile()
 
     with gr.Tab("Receipts"):
-        upload_receipt_feature() 
+        _, receipt_confirmed = upload_receipt_feature()
 
     with gr.Tab("Dashboard"):
         create_dashboard()  # ✅ No `.render()`  # ✅ No `.render()`
 
     with gr.Tab("Tax Deduction Suggestions"):
-        tax_summary()
+        tax_summary(refresh_on=[receipt_confirmed, income_updated])
 
     with gr.Tab("Tax Readiness"):
         tax_readiness_feat()
 
-app.launch(server_name="0.0.0.0", server_port=7860)
+    # Unload only fires on the root Blocks, so chat sessions are released here when a tab closes
+    app.unload(end_chat_session)
+
+# Scans, AI calls and store writes are limited per lane (see scheduler.py); Gradio only bounds the rest
+app.queue(default_concurrency_limit=4, max_size=APP_QUEUE_MAX_SIZE)
+app.launch(server_name="0.0.0.0", server_port=7860, max_threads=thread_budget())
@@ -0,0 +1,61 @@
+# benchmarks/common.py
+
+import json
+import math
+import platform
+import subprocess
+import time
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize_ms(samples):
+    """p50/p95/mean in milliseconds for a list of durations in seconds"""
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0,
+        "n": len(samples),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_metadata():
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+
+
+def write_results(path, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare(results, baseline_path, key="stages", metric="p50_ms"):
+    """Print the change of each entry's metric against a previous results file"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparison of {metric} against {baseline_path} ({baseline['meta']['revision']}):")
+    for name, current in results[key].items():
+        before = baseline.get(key, {}).get(name, {}).get(metric)
+        if not before:
+            print(f"  {name:<14} {current[metric]:>10.3f}   (new)")
+            continue
+        change = (current[metric] - before) / before * 100
+        print(f"  {name:<14} {current[metric]:>10.3f}   was {before:>10.3f}   {change:+6.1f}%")
@@ -0,0 +1,110 @@
+"""
+Benchmark of the Profile page's income editor, fully offline.
+
+Builds the Profile tab on its own and reports what it costs the browser and
+the server:
+
+    components      components on the page
+    events          event listeners registered
+    payload_bytes   size of the page config the browser downloads
+    toggle_outputs  components updated by one Edit/Save click
+
+and times, through Gradio's own preprocess/call/postprocess path:
+
+    toggle    one Edit Profile click                    (toggle_edit_mode)
+    edit      one income edit and the new month totals  (update_income)
+
+Run it on an older revision with --output and compare against it with
+--compare to see the change.
+
+Usage:
+    python -m benchmarks.profile_editor
+    python -m benchmarks.profile_editor --output profile.json --compare previous.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import compare, run_metadata, summarize_ms, write_results
+
+STEPS = ("toggle", "edit")
+
+
+def find_fn(blocks, *names):
+    for block_fn in blocks.fns.values():
+        if getattr(block_fn.fn, "__name__", None) in names:
+            return block_fn
+    raise LookupError(f"no event handler named {' or '.join(names)}")
+
+
+def edit_inputs(block_fn):
+    """Payload of an edit adding RM 4,500 of salary to January"""
+    if block_fn.fn.__name__ == "update_income":
+        from income_ledger import INCOME_HEADERS
+
+        return [{"headers": INCOME_HEADERS, "data": [["January", "Salary", 4500]]}]
+    # per-field editor: one Number per income row of the month
+    return [4500] + [0] * (len(block_fn.inputs) - 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200, help="calls timed per step")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    import gradio as gr
+    from gradio.state_holder import SessionState
+
+    from Profile import create_profile
+
+    with gr.Blocks() as blocks:
+        create_profile()
+    config = json.dumps(blocks.get_config_file(), default=str)
+    toggle = find_fn(blocks, "toggle_edit_mode")
+    edit = find_fn(blocks, "update_income", "calculate_total")
+
+    async def run(block_fn, inputs, iterations):
+        state = SessionState(blocks)
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await blocks.process_api(block_fn=block_fn, inputs=inputs, state=state)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    timings = {
+        "toggle": asyncio.run(run(toggle, [False], args.iterations)),
+        "edit": asyncio.run(run(edit, edit_inputs(edit), args.iterations)),
+    }
+
+    results = {
+        "meta": {**run_metadata(), "iterations": args.iterations},
+        "page": {
+            "components": {"count": len(blocks.blocks)},
+            "events": {"count": len(blocks.fns)},
+            "payload_bytes": {"count": len(config)},
+            "toggle_outputs": {"count": len(toggle.outputs)},
+        },
+        "steps": {step: summarize_ms(samples) for step, samples in timings.items()},
+    }
+    print(f"Profile editor benchmark ({args.iterations} calls per step)")
+    for name, value in results["page"].items():
+        print(f"  {name:<14} {value['count']:>10}")
+    print(f"  {'step':<14} {'p50 ms':>10} {'p95 ms':>10}")
+    for name, summary in results["steps"].items():
+        print(f"  {name:<14} {summary['p50_ms']:>10.3f} {summary['p95_ms']:>10.3f}")
+
+    if args.output:
+        write_results(args.output, results)
+    if args.compare:
+        compare(results, args.compare, key="page", metric="count")
+        compare(results, args.compare, key="steps", metric="p50_ms")
+    return results
+
+
+if __name__ == "__main__":
+    main()
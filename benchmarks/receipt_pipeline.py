@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark of the receipt pipeline, fully offline.
+
+Runs every receipt in the corpus through the same stages as a real scan:
+
+    open      read the upload and open it with PIL        (process_receipt)
+    encode    decode, normalise + base64 encode           (image_to_base64)
+    model     VLM call, served by a local backend         (parse_receipt_qwen)
+    extract   recover the receipt from the answer text    (_extract_result)
+    format    build the text shown in the UI              (format_receipt_info)
+    upload    duplicate check, then image + JSON to a     (upload_to_oss)
+              local OSS stand-in
+
+and reports per-stage p50/p95 latency, bytes moved and peak memory.
+
+Usage:
+    python -m benchmarks.receipt_pipeline
+    python -m benchmarks.receipt_pipeline --backend replay --replay-dir recordings/receipts
+    python -m benchmarks.receipt_pipeline --output bench.json --compare previous.json
+"""
+
+import argparse
+import glob
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from PIL import Image, ImageDraw
+
+from benchmarks.common import compare, run_metadata, summarize_ms, write_results
+
+STAGES = ("open", "encode", "model", "extract", "format", "upload")
+
+# Synthetic receipts covering what phones and scanners produce
+SYNTHETIC_CORPUS = (
+    ("small.jpg", (800, 1200), "RGB", "JPEG"),
+    ("phone_12mp.jpg", (3024, 4032), "RGB", "JPEG"),
+    ("screenshot.png", (1170, 2532), "RGBA", "PNG"),
+    ("scan_gray.png", (2480, 3508), "L", "PNG"),
+    ("wide_landscape.jpg", (4032, 3024), "RGB", "JPEG"),
+)
+
+
+def _draw_receipt(size, mode, seed):
+    rng = random.Random(seed)
+    background = (255, 255, 255, 255) if mode == "RGBA" else (255 if mode == "L" else (250, 248, 240))
+    image = Image.new(mode, size, background)
+    draw = ImageDraw.Draw(image)
+    line_height = max(12, size[1] // 60)
+    ink = 0 if mode == "L" else (20, 20, 20, 255) if mode == "RGBA" else (20, 20, 20)
+    for row in range(2, size[1] // line_height - 2):
+        y = row * line_height
+        width = rng.randint(size[0] // 4, size[0] - size[0] // 8)
+        draw.rectangle((size[0] // 16, y, width, y + line_height // 2), fill=ink)
+    return image
+
+
+def build_corpus(directory):
+    """Write the synthetic receipts plus the sample images in img/ to directory"""
+    paths = []
+    for i, (name, size, mode, fmt) in enumerate(SYNTHETIC_CORPUS):
+        path = os.path.join(directory, name)
+        _draw_receipt(size, mode, seed=i).save(path, format=fmt, **({"quality": 92} if fmt == "JPEG" else {}))
+        paths.append(path)
+    for sample in sorted(glob.glob("img/*.png") + glob.glob("img/*.jpeg") + glob.glob("img/*.jpg")):
+        paths.append(sample)
+    return paths
+
+
+def make_backend(args):
+    from receipt_backends import ReplayBackend, StubBackend
+    if args.backend == "replay":
+        return ReplayBackend(args.replay_dir, mode="replay", latency=args.latency)
+    return StubBackend(latency=args.latency)
+
+
+class _Upload:
+    """Mimics the tempfile wrapper Gradio hands to process_receipt"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def run_once(path, backend, timings, sizes):
+    """Push one receipt through every stage, appending durations to timings"""
+    from receipt_parser import RECEIPT_PROMPT, _extract_result, image_to_base64
+    from UploadReceipt import format_receipt_info, upload_to_oss
+
+    upload = _Upload(path)
+    t0 = time.perf_counter()
+    with open(upload.name, "rb") as f:
+        image_bytes = f.read()
+    # Left undecoded, as in process_receipt, so JPEGs take the reduced draft() decode in encode
+    image = Image.open(upload.name)
+    t1 = time.perf_counter()
+    img_base64 = image_to_base64(image, original_size=len(image_bytes))
+    t2 = time.perf_counter()
+    answer = backend.generate(img_base64, RECEIPT_PROMPT)
+    t3 = time.perf_counter()
+    parsed = _extract_result(answer)
+    t4 = time.perf_counter()
+    format_receipt_info(parsed)
+    t5 = time.perf_counter()
+    # A stable id per file makes repeat passes retries rather than duplicate receipts
+    receipt_id = str(uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(path)))
+    success, result = upload_to_oss(upload.name, dict(parsed), receipt_id=receipt_id)
+    t6 = time.perf_counter()
+    if not success:
+        raise RuntimeError(f"Upload to local OSS stand-in failed: {result}")
+
+    for stage, start, end in zip(STAGES, (t0, t1, t2, t3, t4, t5), (t1, t2, t3, t4, t5, t6)):
+        timings[stage].append(end - start)
+    timings["total"].append(t6 - t0)
+    sizes["original"].append(len(image_bytes))
+    sizes["request"].append(len(img_base64))
+    sizes["response"].append(len(answer.encode()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5, help="passes over the corpus")
+    parser.add_argument("--backend", choices=("stub", "replay"), default="stub")
+    parser.add_argument("--replay-dir", default=os.path.join("recordings", "receipts"))
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated model latency in seconds")
+    parser.add_argument("--corpus", help="directory of receipt images to use instead of the generated corpus")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="receipt-bench-")
+    # Point every side effect at throwaway local stand-ins before the app modules load
+    os.environ["OSS_LOCAL_DIR"] = os.path.join(workdir, "oss")
+    os.environ["RECEIPT_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["RECEIPT_DUPLICATE_INDEX"] = os.path.join(workdir, "duplicates.jsonl")
+    os.environ["RECEIPT_THUMBNAIL_DIR"] = os.path.join(workdir, "thumbnails")
+    os.environ["RECEIPT_DB_PATH"] = os.path.join(workdir, "receipts.db")
+    os.environ["RECEIPT_IMAGE_DIR"] = os.path.join(workdir, "images")
+    os.environ["RECEIPT_SPOOL_DIR"] = os.path.join(workdir, "spool")
+
+    if args.corpus:
+        corpus = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus))
+    else:
+        os.makedirs(os.path.join(workdir, "corpus"))
+        corpus = build_corpus(os.path.join(workdir, "corpus"))
+    backend = make_backend(args)
+
+    logging.disable(logging.INFO)
+
+    timings = {stage: [] for stage in STAGES + ("total",)}
+    sizes = {"original": [], "request": [], "response": []}
+    # Warm-up pass so imports and first-call costs do not skew the numbers
+    for path in corpus:
+        run_once(path, backend, {k: [] for k in timings}, {k: [] for k in sizes})
+    for _ in range(args.iterations):
+        for path in corpus:
+            run_once(path, backend, timings, sizes)
+
+    # Python heap is measured in a separate pass because tracemalloc slows every
+    # allocation; it does not see Pillow's pixel buffers, hence the RSS high-water mark
+    peaks = []
+    for path in corpus:
+        tracemalloc.start()
+        run_once(path, backend, {k: [] for k in timings}, {k: [] for k in sizes})
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    uploaded = 0
+    for root, _, files in os.walk(os.environ["OSS_LOCAL_DIR"]):
+        uploaded += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+
+    runs = args.iterations * len(corpus) + 2 * len(corpus)
+    results = {
+        "meta": {**run_metadata(), "backend": args.backend, "iterations": args.iterations,
+                 "corpus_size": len(corpus), "latency_s": args.latency},
+        "stages": {name: summarize_ms(samples) for name, samples in timings.items()},
+        "bytes": {
+            "original_total": sum(sizes["original"]),
+            "request_total": sum(sizes["request"]),
+            "response_total": sum(sizes["response"]),
+            "uploaded_per_receipt": round(uploaded / runs),
+            "request_per_receipt": round(sum(sizes["request"]) / len(sizes["request"])),
+        },
+        "memory": {
+            "heap_peak_max_mb": round(max(peaks) / 2 ** 20, 2),
+            "heap_peak_mean_mb": round(sum(peaks) / len(peaks) / 2 ** 20, 2),
+            "rss_max_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+
+    print(f"Receipt pipeline benchmark ({len(corpus)} receipts x {args.iterations} iterations, {args.backend} backend)")
+    print(f"  {'stage':<10} {'p50 ms':>10} {'p95 ms':>10}")
+    for name, summary in results["stages"].items():
+        print(f"  {name:<10} {summary['p50_ms']:>10.3f} {summary['p95_ms']:>10.3f}")
+    print(f"  bytes/receipt: original {results['bytes']['original_total'] // len(sizes['original'])}, "
+          f"request {results['bytes']['request_per_receipt']}, uploaded {results['bytes']['uploaded_per_receipt']}")
+    print(f"  peak memory: python heap max {results['memory']['heap_peak_max_mb']} MB, "
+          f"process RSS {results['memory']['rss_max_mb']} MB")
+
+    if args.output:
+        write_results(args.output, results)
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+
+if __name__ == "__main__":
+    main()
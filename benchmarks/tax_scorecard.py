@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of the tax payable scorecard, fully offline.
+
+Times each step the Tax Deduction tab runs on load and on every refresh:
+
+    bands     progressive rate bands on one chargeable income   (band_tax_cents)
+    cold      reliefs, bands and rebate with an empty memo      (compute_tax)
+    warm      the same inputs again, served from the memo       (compute_tax)
+    claims    relief claims for the year from the ledger        (relief_claims)
+    scorecard claims + memoised tax + HTML                      (tax_scorecard)
+
+and reports p50/p95 in microseconds. The scorecard it replaced slept for 2 s.
+
+Usage:
+    python -m benchmarks.tax_scorecard
+    python -m benchmarks.tax_scorecard --output tax.json --compare previous.json
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import compare, percentile, run_metadata, write_results
+
+STEPS = ("bands", "cold", "warm", "claims", "scorecard")
+
+
+def summarize_us(samples):
+    """p50/p95/mean in microseconds for a list of durations in seconds"""
+    return {
+        "p50_us": round(percentile(samples, 50) * 1e6, 2),
+        "p95_us": round(percentile(samples, 95) * 1e6, 2),
+        "mean_us": round(sum(samples) / len(samples) * 1e6, 2) if samples else 0.0,
+        "n": len(samples),
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10000, help="calls timed per step")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    # Keep the receipt store of the benchmark away from real data
+    os.environ.setdefault("RECEIPT_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="tax_bench_"), "receipts.db"))
+    from relief_engine import relief_claims
+    from tax_calculator import _compute, band_tax_cents, compute_tax
+    from TaxDeduction import tax_scorecard
+
+    rng = random.Random(0)
+    incomes = [rng.randint(0, 3_000_000) for _ in range(args.iterations)]
+    claims = relief_claims()
+    timings = {step: [] for step in STEPS}
+    for income in incomes:
+        timings["bands"].append(timed(band_tax_cents, income * 100))
+    for income in incomes:
+        _compute.cache_clear()
+        timings["cold"].append(timed(compute_tax, income, claims))
+    compute_tax(incomes[0], claims)
+    for _ in incomes:
+        timings["warm"].append(timed(compute_tax, incomes[0], claims))
+    for _ in incomes:
+        timings["claims"].append(timed(relief_claims))
+    for _ in incomes:
+        timings["scorecard"].append(timed(tax_scorecard))
+
+    results = {
+        "meta": {**run_metadata(), "iterations": args.iterations},
+        "steps": {step: summarize_us(samples) for step, samples in timings.items()},
+    }
+    print(f"Tax scorecard benchmark ({args.iterations} calls per step)")
+    print(f"  {'step':<10} {'p50 us':>10} {'p95 us':>10}")
+    for name, summary in results["steps"].items():
+        print(f"  {name:<10} {summary['p50_us']:>10.2f} {summary['p95_us']:>10.2f}")
+
+    if args.output:
+        write_results(args.output, results)
+    if args.compare:
+        compare(results, args.compare, key="steps", metric="p50_us")
+    return results
+
+
+if __name__ == "__main__":
+    main()
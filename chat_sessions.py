@@ -0,0 +1,60 @@
+# chat_sessions.py
+
+import os
+import threading
+
+from ttl_cache import TTLCache
+
+# Chat sessions idle for this many seconds are forgotten; the next message starts a new conversation
+CHAT_SESSION_IDLE_TTL = float(os.getenv('CHAT_SESSION_IDLE_TTL', '1800'))
+CHAT_SESSION_MAX = int(os.getenv('CHAT_SESSION_MAX', '10000'))
+
+
+class ChatSessionStore:
+    """
+    DashScope conversation id of each browser session, keyed on Gradio's
+    session hash. Sessions expire after idle_ttl seconds without a message,
+    and beyond max_sessions the least recently active one is evicted.
+    """
+
+    def __init__(self, max_sessions=CHAT_SESSION_MAX, idle_ttl=CHAT_SESSION_IDLE_TTL):
+        self._sessions = TTLCache(max_entries=max_sessions, ttl=idle_ttl, sliding=True)
+        self._lock = threading.Lock()
+        self.started = 0
+        self.ended = 0
+
+    def get(self, session_key):
+        """Conversation id of a browser session, or None to start a new conversation"""
+        if not session_key:
+            return None
+        return self._sessions.get(session_key)
+
+    def set(self, session_key, session_id):
+        if not session_key or not session_id:
+            return
+        new = session_key not in self._sessions
+        self._sessions.put(session_key, session_id)
+        if new:
+            with self._lock:
+                self.started += 1
+
+    def end(self, session_key):
+        """Forget a browser session, e.g. when its tab is closed"""
+        if session_key and self._sessions.pop(session_key) is not None:
+            with self._lock:
+                self.ended += 1
+
+    def stats(self):
+        """Live sessions and how sessions have ended"""
+        self._sessions.purge()
+        cache = self._sessions.stats()
+        return {
+            "live_sessions": cache["entries"],
+            "started": self.started,
+            "ended": self.ended,
+            "expired": cache["expirations"],
+            "evicted": cache["evictions"],
+        }
+
+
+chat_sessions = ChatSessionStore()
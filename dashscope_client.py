@@ -0,0 +1,418 @@
+# dashscope_client.py
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+
+import httpx
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope-intl.aliyuncs.com/api/v1")
+DEFAULT_TIMEOUT = float(os.getenv("DASHSCOPE_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("DASHSCOPE_CONNECT_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("DASHSCOPE_MAX_RETRIES", "3"))
+POOL_SIZE = int(os.getenv("DASHSCOPE_POOL_SIZE", "20"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when DashScope has failed repeatedly and calls are short-circuited"""
+
+
+@dataclass
+class DashScopeResponse:
+    """Subset of the DashScope response envelope used by the app"""
+    status_code: int
+    output: dict = field(default_factory=dict)
+    usage: dict = field(default_factory=dict)
+    request_id: str = ""
+    code: str = ""
+    message: str = ""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failed calls the circuit opens and calls fail fast
+    for reset_timeout seconds. Then a single probe call is let through; its
+    outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            # A probe that never reported back (e.g. cancelled) expires after reset_timeout
+            probe_stale = time.monotonic() - self.probe_started >= self.reset_timeout
+            if state == "half-open" and (not self.probe_in_flight or probe_stale):
+                self.probe_in_flight = True
+                self.probe_started = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                logger.warning(f"DashScope circuit opened after {self.failures} consecutive failures")
+
+
+class DashScopeClient:
+    """
+    Async DashScope HTTP client with a keep-alive connection pool, per-call
+    timeouts, jittered exponential backoff on 429/5xx and a circuit breaker.
+
+    The coroutines must run on the loop that owns the client; use the module
+    level helpers below, which route every call onto the shared client loop.
+    """
+
+    def __init__(self, api_key=None, base_url=BASE_URL, timeout=DEFAULT_TIMEOUT,
+                 max_retries=MAX_RETRIES, pool_size=POOL_SIZE, breaker=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self._http = None
+
+    def _http_client(self):
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                    keepalive_expiry=60,
+                ),
+            )
+        return self._http
+
+    def _headers(self):
+        api_key = self.api_key or os.getenv("DASHSCOPE_API_KEY")
+        if not api_key:
+            raise ValueError("DASHSCOPE_API_KEY not found in environment variables")
+        return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    def _backoff(self, attempt, response=None):
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(float(response.headers["Retry-After"]), BACKOFF_MAX)
+        # Full jitter keeps a burst of throttled workers from retrying in lockstep
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    async def _post(self, path, body, timeout=None):
+        headers = self._headers()
+        if not self.breaker.allow():
+            raise CircuitOpenError("DashScope is unavailable, please try again shortly")
+
+        http = self._http_client()
+        call_timeout = httpx.Timeout(timeout or self.timeout, connect=CONNECT_TIMEOUT)
+        response = None
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await http.post(path, json=body, headers=headers, timeout=call_timeout)
+                error = None
+            except httpx.TransportError as e:
+                response, error = None, e
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return _to_response(response)
+
+            if attempt == self.max_retries:
+                break
+            delay = self._backoff(attempt, response)
+            logger.warning(
+                f"DashScope call to {path} failed "
+                f"({error or response.status_code}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+        self.breaker.record_failure()
+        if error is not None:
+            raise error
+        return _to_response(response)
+
+    async def _stream(self, path, body, timeout=None):
+        """POST with server-sent events enabled, yielding one DashScopeResponse per event"""
+        headers = {**self._headers(), "Accept": "text/event-stream", "X-DashScope-SSE": "enable"}
+        if not self.breaker.allow():
+            raise CircuitOpenError("DashScope is unavailable, please try again shortly")
+
+        http = self._http_client()
+        call_timeout = httpx.Timeout(timeout or self.timeout, connect=CONNECT_TIMEOUT)
+        status = None
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                async with http.stream("POST", path, json=body, headers=headers, timeout=call_timeout) as response:
+                    status, error = response.status_code, None
+                    if status not in RETRY_STATUSES:
+                        self.breaker.record_success()
+                        if status != HTTPStatus.OK:
+                            await response.aread()
+                            yield _to_response(response)
+                            return
+                        async for event in _iter_sse(response):
+                            started = True
+                            yield event
+                        return
+                    retry_after = response.headers.get("Retry-After", "")
+            except httpx.TransportError as e:
+                # Partial output has already reached the caller, so a retry would duplicate it
+                if started:
+                    raise
+                status, error, retry_after = None, e, ""
+
+            if attempt == self.max_retries:
+                break
+            delay = min(float(retry_after), BACKOFF_MAX) if retry_after.isdigit() else self._backoff(attempt)
+            logger.warning(
+                f"DashScope stream to {path} failed "
+                f"({error or status}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+
+        self.breaker.record_failure()
+        if error is not None:
+            raise error
+        yield DashScopeResponse(status_code=status, code="Unavailable", message=f"HTTP {status}")
+
+    async def multimodal_generation(self, model, messages, timeout=None, **parameters):
+        """Call a multimodal model such as Qwen-VL"""
+        body = {"model": model, "input": {"messages": messages}, "parameters": parameters}
+        return await self._post("/services/aigc/multimodal-generation/generation", body, timeout)
+
+    async def stream_multimodal_generation(self, model, messages, timeout=None, **parameters):
+        """Stream a multimodal call; each event carries only the newly generated text"""
+        parameters = {**parameters, "incremental_output": True}
+        body = {"model": model, "input": {"messages": messages}, "parameters": parameters}
+        async for event in self._stream("/services/aigc/multimodal-generation/generation", body, timeout):
+            yield event
+
+    async def application_completion(self, app_id, prompt, session_id=None, timeout=None, **parameters):
+        """Call a ModelStudio application (e.g. the RAG tax advisor)"""
+        payload = {"prompt": prompt}
+        if session_id:
+            payload["session_id"] = session_id
+        body = {"input": payload, "parameters": parameters}
+        return await self._post(f"/apps/{app_id}/completion", body, timeout)
+
+    async def stream_application_completion(self, app_id, prompt, session_id=None, timeout=None, **parameters):
+        """Stream a ModelStudio application call; each event carries only the newly generated text"""
+        payload = {"prompt": prompt}
+        if session_id:
+            payload["session_id"] = session_id
+        body = {"input": payload, "parameters": {**parameters, "incremental_output": True}}
+        async for event in self._stream(f"/apps/{app_id}/completion", body, timeout):
+            yield event
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+def _to_response(response):
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {"message": response.text}
+    return DashScopeResponse(
+        status_code=response.status_code,
+        output=payload.get("output") or {},
+        usage=payload.get("usage") or {},
+        request_id=payload.get("request_id", ""),
+        code=payload.get("code", "") if response.status_code != HTTPStatus.OK else "",
+        message=payload.get("message", "") if response.status_code != HTTPStatus.OK else "",
+    )
+
+
+async def _iter_sse(response):
+    """Decode a DashScope server-sent event stream into DashScopeResponse objects"""
+    event, status, data = None, HTTPStatus.OK, []
+    async for line in response.aiter_lines():
+        if line:
+            if line.startswith("data:"):
+                data.append(line[5:])
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith(":HTTP_STATUS/"):
+                status = int(line[len(":HTTP_STATUS/"):])
+            continue
+        if data:
+            yield _sse_response(event, status, "\n".join(data))
+        event, status, data = None, HTTPStatus.OK, []
+    if data:
+        yield _sse_response(event, status, "\n".join(data))
+
+
+def _sse_response(event, status, data):
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return DashScopeResponse(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, code="Unknown", message=data)
+    if event == "error" or status != HTTPStatus.OK:
+        return DashScopeResponse(
+            status_code=status if status != HTTPStatus.OK else HTTPStatus.INTERNAL_SERVER_ERROR,
+            request_id=payload.get("request_id", ""),
+            code=payload.get("code", ""),
+            message=payload.get("message", ""),
+        )
+    return DashScopeResponse(
+        status_code=HTTPStatus.OK,
+        output=payload.get("output") or {},
+        usage=payload.get("usage") or {},
+        request_id=payload.get("request_id", ""),
+    )
+
+
+# --- Shared client and event loop ---
+# Gradio runs sync handlers on worker threads, so the pooled client lives on one
+# background loop and every caller (sync or async) is routed onto it.
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+
+def _get_loop():
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="dashscope-client", daemon=True).start()
+        return _loop
+
+
+def get_client():
+    """Return the process-wide DashScope client"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = DashScopeClient()
+        return _client
+
+
+def run_sync(coro):
+    """Run a client coroutine from a regular thread and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+async def _run_async(coro):
+    loop = _get_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+async def multimodal_generation(model, messages, **kwargs):
+    """Async multimodal call usable from any event loop"""
+    return await _run_async(get_client().multimodal_generation(model, messages, **kwargs))
+
+
+async def application_completion(app_id, prompt, **kwargs):
+    """Async application call usable from any event loop"""
+    return await _run_async(get_client().application_completion(app_id, prompt, **kwargs))
+
+
+def call_multimodal(model, messages, **kwargs):
+    """Blocking multimodal call for sync callers"""
+    return run_sync(get_client().multimodal_generation(model, messages, **kwargs))
+
+
+def call_application(app_id, prompt, **kwargs):
+    """Blocking application call for sync callers"""
+    return run_sync(get_client().application_completion(app_id, prompt, **kwargs))
+
+
+_DONE = object()
+
+
+def iter_sync(agen):
+    """
+    Iterate a client async generator from a regular thread.
+
+    Closing the returned generator (e.g. a Gradio client disconnecting) cancels
+    the upstream task, which closes the HTTP stream.
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((item, None))
+        except asyncio.CancelledError:
+            items.put((_DONE, None))
+            raise
+        except BaseException as e:
+            items.put((_DONE, e))
+        else:
+            items.put((_DONE, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_loop())
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
+
+
+def stream_multimodal(model, messages, **kwargs):
+    """Blocking iterator over an incremental multimodal call"""
+    return iter_sync(get_client().stream_multimodal_generation(model, messages, **kwargs))
+
+
+def stream_application(app_id, prompt, **kwargs):
+    """Blocking iterator over an incremental application call"""
+    return iter_sync(get_client().stream_application_completion(app_id, prompt, **kwargs))
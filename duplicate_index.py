@@ -0,0 +1,273 @@
+# duplicate_index.py
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import defaultdict, namedtuple
+from itertools import combinations
+from decimal import Decimal
+from functools import lru_cache
+
+from PIL import Image, ImageOps
+
+from receipt_schema import parse_amount, parse_date
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_INDEX_PATH = os.getenv('RECEIPT_DUPLICATE_INDEX', os.path.join('data', 'duplicates.jsonl'))
+# Largest Hamming distance between 128-bit image hashes still treated as the same
+# image. Re-encoded, resized or slightly rotated copies land well inside it, while
+# different receipts printed from one template (same merchant) are ~20 bits apart;
+# retakes of a paper receipt are caught by the (merchant, date, total) fingerprint.
+DUPLICATE_MAX_DISTANCE = int(os.getenv('RECEIPT_DUPLICATE_DISTANCE', '8'))
+# Hashes with fewer set (or clear) bits than this carry too little detail, e.g. blank photos
+MIN_HASH_BITS = 8
+HASH_BITS = 128
+
+Match = namedtuple("Match", ["receipt_id", "reason", "distance", "summary"])
+
+
+class DuplicateReceiptError(ValueError):
+    """Raised when a receipt matches one the user has already stored"""
+
+    def __init__(self, match):
+        super().__init__(f"Duplicate receipt: {match.reason} {match.summary or match.receipt_id}")
+        self.match = match
+
+
+def image_hash(image):
+    """
+    128-bit difference hash: 64 horizontal and 64 vertical brightness gradients
+    on an 8x8 grid. Horizontal gradients alone mostly encode the left-aligned
+    layout every receipt shares; vertical ones capture the line structure.
+    """
+    gray = ImageOps.exif_transpose(image).convert("L")
+    wide = gray.resize((9, 8), Image.Resampling.BOX).tobytes()
+    tall = gray.resize((8, 9), Image.Resampling.BOX).tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (wide[row * 9 + col] > wide[row * 9 + col + 1])
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (tall[row * 8 + col] > tall[(row + 1) * 8 + col])
+    return value
+
+
+def informative(value_hash):
+    """Whether an image hash has enough detail to identify an image"""
+    return MIN_HASH_BITS <= value_hash.bit_count() <= HASH_BITS - MIN_HASH_BITS
+
+
+@lru_cache(maxsize=256)
+def _hash_file(path, size, mtime_ns):
+    with Image.open(path) as image:
+        image.draft("L", (32, 32))
+        return image_hash(image)
+
+
+def image_hash_file(path):
+    """Image hash of a file, decoding JPEGs at reduced size; the scan and confirm steps share it"""
+    stat = os.stat(path)
+    return _hash_file(path, stat.st_size, stat.st_mtime_ns)
+
+
+def receipt_fingerprint(receipt_data):
+    """(merchant, date, total) key of a receipt dict, or None when any part is missing"""
+    merchant = re.sub(r"[^a-z0-9]", "", (receipt_data.get("Merchant name") or "").lower())
+    purchased = parse_date(receipt_data.get("Date of purchase"))
+    total = parse_amount(receipt_data.get("Total amount spent"))
+    if not merchant or purchased is None or total is None:
+        return None
+    return f"{merchant}|{purchased.isoformat()}|{total.quantize(Decimal('0.01'))}"
+
+
+def _summary(receipt_data):
+    parts = [receipt_data.get("Merchant name"), receipt_data.get("Date of purchase"),
+             receipt_data.get("Total amount spent")]
+    return ", ".join(str(part) for part in parts if part)
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 128-bit hashes. Each hash is split into eight 16-bit
+    substrings with a table per substring. A hash within max_distance of the
+    query has some substring within max_distance // 8 of the query's (pigeonhole),
+    so only those buckets are probed and their few candidates verified.
+    """
+
+    CHUNKS = 8
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self.tables = [defaultdict(list) for _ in range(self.CHUNKS)]
+        self.size = 0
+
+    def _chunks(self, value_hash):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value_hash >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def _probes(self, chunk, radius):
+        for flips in range(radius + 1):
+            for bits in combinations(range(self.CHUNK_BITS), flips):
+                probe = chunk
+                for bit in bits:
+                    probe ^= 1 << bit
+                yield probe
+
+    def add(self, value_hash, value):
+        self.size += 1
+        for table, chunk in zip(self.tables, self._chunks(value_hash)):
+            table[chunk].append((value_hash, value))
+
+    def search(self, value_hash, max_distance):
+        """All (distance, value) within max_distance of value_hash, closest first"""
+        radius = max_distance // self.CHUNKS
+        found = {}
+        for table, chunk in zip(self.tables, self._chunks(value_hash)):
+            for probe in self._probes(chunk, radius):
+                for candidate, value in table.get(probe, ()):
+                    distance = (candidate ^ value_hash).bit_count()
+                    if distance <= max_distance:
+                        found[value] = distance
+        return sorted(((distance, value) for value, distance in found.items()), key=lambda pair: pair[0])
+
+
+class DuplicateIndex:
+    """
+    Per-user index of stored receipts by image hash (multi-index hashing, so
+    near-duplicate lookups stay sub-linear) and by exact (merchant, date,
+    total) fingerprint.
+    Entries are journaled to a JSONL file and replayed on first use. A
+    receipt whose upload was given up on stays indexed but marked failed, so
+    confirming it again retries it under its id instead of being rejected.
+    """
+
+    def __init__(self, path=DUPLICATE_INDEX_PATH, max_distance=DUPLICATE_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._hashes = defaultdict(MultiIndexHash)
+        self._fingerprints = defaultdict(dict)
+        self._summaries = {}
+        self._known = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _index(self, entry):
+        key = (entry["user_id"], entry["receipt_id"])
+        if "failed" in entry:
+            (self._failed.add if entry["failed"] else self._failed.discard)(key)
+            return
+        if key in self._known:
+            return
+        self._known.add(key)
+        self._summaries[key] = entry.get("summary", "")
+        if entry.get("image_hash") is not None and informative(entry["image_hash"]):
+            self._hashes[entry["user_id"]].add(entry["image_hash"], entry["receipt_id"])
+        if entry.get("fingerprint"):
+            self._fingerprints[entry["user_id"]][entry["fingerprint"]] = entry["receipt_id"]
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    self._index(json.loads(line))
+                except (ValueError, KeyError):
+                    logger.warning("Skipping unreadable duplicate index line: %.80s", line)
+
+    def _find(self, user_id, image_hash, fingerprint, exclude, failed=False):
+        """Closest match among stored receipts, or among failed ones with failed=True"""
+        def wanted(receipt_id):
+            return receipt_id != exclude and ((user_id, receipt_id) in self._failed) == failed
+
+        if fingerprint:
+            receipt_id = self._fingerprints[user_id].get(fingerprint)
+            if receipt_id and wanted(receipt_id):
+                return Match(receipt_id, "same merchant, date and total as", None,
+                             self._summaries.get((user_id, receipt_id)))
+        if image_hash is not None and informative(image_hash):
+            for distance, receipt_id in self._hashes[user_id].search(image_hash, self.max_distance):
+                if wanted(receipt_id):
+                    return Match(receipt_id, "same image as", distance,
+                                 self._summaries.get((user_id, receipt_id)))
+        return None
+
+    def _journal(self, entry):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def find(self, user_id, image_hash=None, fingerprint=None, exclude=None):
+        """Closest stored receipt matching either key, ignoring receipt `exclude` and failed uploads"""
+        with self._lock:
+            self._load()
+            return self._find(user_id, image_hash, fingerprint, exclude)
+
+    def check_and_add(self, user_id, receipt_id, image_hash=None, receipt_data=None):
+        """
+        Record a receipt unless it matches another stored one, in one step so
+        concurrent confirmations of the same receipt cannot both pass. Raises
+        DuplicateReceiptError on a match, except with a receipt whose upload
+        failed: that receipt is claimed again and its id returned for the
+        retry. Otherwise returns receipt_id; re-adding a receipt is a no-op.
+        """
+        fingerprint = receipt_fingerprint(receipt_data) if receipt_data else None
+        with self._lock:
+            self._load()
+            match = self._find(user_id, image_hash, fingerprint, exclude=receipt_id)
+            if match:
+                raise DuplicateReceiptError(match)
+            retry = self._find(user_id, image_hash, fingerprint, exclude=receipt_id, failed=True)
+            if retry:
+                receipt_id = retry.receipt_id
+            key = (user_id, receipt_id)
+            if key in self._failed:
+                entry = {"user_id": user_id, "receipt_id": receipt_id, "failed": False}
+            elif key not in self._known:
+                entry = {
+                    "user_id": user_id,
+                    "receipt_id": receipt_id,
+                    "image_hash": image_hash,
+                    "fingerprint": fingerprint,
+                    "summary": _summary(receipt_data) if receipt_data else "",
+                }
+            else:
+                return receipt_id
+            self._index(entry)
+            self._journal(entry)
+        return receipt_id
+
+    def mark_failed(self, user_id, receipt_id):
+        """Mark a receipt that never reached storage, so confirming it again is allowed"""
+        entry = {"user_id": user_id, "receipt_id": receipt_id, "failed": True}
+        with self._lock:
+            self._load()
+            if (user_id, receipt_id) not in self._known or (user_id, receipt_id) in self._failed:
+                return
+            self._index(entry)
+            self._journal(entry)
+
+
+duplicate_index = DuplicateIndex()
+
+
+def check_duplicate(user_id, image_hash=None, receipt_data=None, exclude=None):
+    """Raise DuplicateReceiptError if the receipt is already stored for this user"""
+    fingerprint = receipt_fingerprint(receipt_data) if receipt_data else None
+    match = duplicate_index.find(user_id, image_hash, fingerprint, exclude=exclude)
+    if match:
+        raise DuplicateReceiptError(match)
+
+
+def check_and_add(user_id, receipt_id, image_hash=None, receipt_data=None):
+    """Record a receipt, raising DuplicateReceiptError if another stored one matches; returns its id"""
+    return duplicate_index.check_and_add(user_id, receipt_id, image_hash, receipt_data)
@@ -0,0 +1,129 @@
+# income_ledger.py
+
+import calendar
+import re
+import threading
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import numpy as np
+
+MONTHS = tuple(calendar.month_name[1:])
+INCOME_HEADERS = ["Month", "Income Source", "Income (RM)"]
+TOTAL_HEADERS = ["Month", "Total Income (RM)"]
+
+_MONTH_INDEX = {name.lower(): i for i, name in enumerate(MONTHS)}
+_MONTH_INDEX.update({name[:3].lower(): i for i, name in enumerate(MONTHS)})
+
+
+def parse_month(value):
+    """Month index 0-11 from a month name, its abbreviation or number, or None"""
+    text = str(value if value is not None else "").strip().lower()
+    if text.isdigit():
+        return int(text) - 1 if 1 <= int(text) <= 12 else None
+    return _MONTH_INDEX.get(text)
+
+
+def parse_cents(value):
+    """Integer cents (0 for a blank cell) from a number or text like 'RM 1,200.50', or None"""
+    if value is None or value == "" or value != value:  # empty or NaN cell
+        return 0
+    text = re.sub(r"(?i)^\s*rm\s*|,", "", str(value))
+    try:
+        amount = Decimal(text.strip() or "0")
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or amount < 0:
+        return None
+    return int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def parse_row(row):
+    """(month index, source, cents) of a grid row, None for a blank row, or raises ValueError"""
+    month, source, amount = (list(row) + [None, None, None])[:3]
+    source = str(source if source is not None else "").strip()
+    if not str(month if month is not None else "").strip() and not source and parse_cents(amount) == 0:
+        return None
+    month_index = parse_month(month)
+    cents = parse_cents(amount)
+    if month_index is None or cents is None:
+        raise ValueError(row)
+    return month_index, source, cents
+
+
+class IncomeLedger:
+    """
+    Income rows of one tax year as (month index, source, cents), with the
+    total of each month kept up to date as the grid is edited: only rows that
+    changed since the last edit touch the totals.
+    """
+
+    def __init__(self, year):
+        self.year = year
+        self._rows = []
+        self._totals = np.zeros(len(MONTHS), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def update(self, grid_rows):
+        """
+        Replace the rows with the edited grid. Returns (rows changed, rows
+        skipped); blank rows are ignored and rows with an unknown month or
+        amount are skipped until they are fixed.
+        """
+        rows, skipped = [], 0
+        for row in grid_rows or []:
+            try:
+                parsed = parse_row(row)
+            except ValueError:
+                skipped += 1
+                continue
+            if parsed is not None:
+                rows.append(parsed)
+
+        changed = 0
+        with self._lock:
+            previous = self._rows
+            for i in range(max(len(previous), len(rows))):
+                before = previous[i] if i < len(previous) else None
+                after = rows[i] if i < len(rows) else None
+                if before == after:
+                    continue
+                changed += 1
+                if before is not None:
+                    self._totals[before[0]] -= before[2]
+                if after is not None:
+                    self._totals[after[0]] += after[2]
+            self._rows = rows
+        return changed, skipped
+
+    def rows(self):
+        """Grid rows of (month name, source, RM)"""
+        with self._lock:
+            return [[MONTHS[month], source, cents / 100] for month, source, cents in self._rows]
+
+    def month_total(self, month):
+        """Total income of a month name in RM"""
+        return int(self._totals[parse_month(month)]) / 100
+
+    def totals(self):
+        """Grid rows of (month name, total RM) for every month"""
+        with self._lock:
+            return [[month, int(cents) / 100] for month, cents in zip(MONTHS, self._totals)]
+
+    def annual_total(self):
+        """Income of the year in RM"""
+        return int(self._totals.sum()) / 100
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def income_ledger(year=None):
+    """The income ledger of a tax year (the current year by default)"""
+    year = year or datetime.today().year
+    with _ledgers_lock:
+        ledger = _ledgers.get(year)
+        if ledger is None:
+            ledger = _ledgers[year] = IncomeLedger(year)
+        return ledger
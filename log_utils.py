@@ -0,0 +1,103 @@
+# log_utils.py
+
+import json
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Longest payload (in characters) written to the log outside debug capture
+LOG_PAYLOAD_CAP = int(os.getenv("LOG_PAYLOAD_CAP", "256"))
+
+# Opt-in full payload capture (raw model answers, parsed receipts) at DEBUG level
+DEBUG_PAYLOADS = os.getenv("LOG_DEBUG_PAYLOADS", "0") == "1"
+
+# Per-logger sampling of INFO/DEBUG records, e.g. "receipt_parser=0.1,UploadReceipt=0.25"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+
+class Payload:
+    """Defers serialising a payload until a handler actually formats the record"""
+
+    __slots__ = ("value", "cap")
+
+    def __init__(self, value, cap=LOG_PAYLOAD_CAP):
+        self.value = value
+        self.cap = cap
+
+    def __str__(self):
+        if isinstance(self.value, str):
+            text = self.value
+        else:
+            text = json.dumps(self.value, default=str, ensure_ascii=False)
+        if self.cap and len(text) > self.cap:
+            return f"{text[:self.cap]}...(+{len(text) - self.cap} chars)"
+        return text
+
+
+class Fields:
+    """Lazily rendered key=value pairs for structured log lines"""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(f"{key}={value}" for key, value in self.fields.items())
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of INFO/DEBUG records; warnings and errors always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def _sample_rates():
+    rates = {}
+    for entry in LOG_SAMPLE_RATES.split(","):
+        name, _, rate = entry.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def get_logger(name):
+    """Module logger with the sampling rate configured for it, if any"""
+    logger = logging.getLogger(name)
+    rate = _sample_rates().get(name)
+    if rate is not None and not any(isinstance(f, SamplingFilter) for f in logger.filters):
+        logger.addFilter(SamplingFilter(rate))
+    if DEBUG_PAYLOADS:
+        logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """
+    Log a structured event as `event key=value ...`. Nothing is formatted
+    unless the record is enabled, sampled in and handled.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s %s", event, Fields(fields), extra={"event": event})
+
+
+def capture_payload(logger, event, value):
+    """
+    Log a payload at DEBUG level: capped at LOG_PAYLOAD_CAP, or in full when
+    LOG_DEBUG_PAYLOADS=1. Free when DEBUG is disabled.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        payload = Payload(value, cap=None if DEBUG_PAYLOADS else LOG_PAYLOAD_CAP)
+        logger.debug("%s payload=%s", event, payload, extra={"event": event})
+
+
+def configure_logging():
+    """Root logging setup shared by the app modules"""
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
@@ -0,0 +1,304 @@
+# oss_store.py
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import oss2
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Configure OSS
+access_key_id = os.getenv('OSS_ACCESS_KEY_ID')
+access_key_secret = os.getenv('OSS_ACCESS_KEY_SECRET')
+endpoint = os.getenv('OSS_ENDPOINT')
+bucket_name = os.getenv('OSS_BUCKET_NAME')
+
+# When set, objects are written to this directory instead of OSS
+local_dir = os.getenv('OSS_LOCAL_DIR')
+
+# Keep-alive connections shared by every bucket client
+OSS_POOL_SIZE = int(os.getenv('OSS_POOL_SIZE', '16'))
+# Concurrent object PUTs, and concurrent multipart part PUTs, across all uploads
+OSS_UPLOAD_CONCURRENCY = int(os.getenv('OSS_UPLOAD_CONCURRENCY', '8'))
+# Files at least this large go up as multipart uploads
+MULTIPART_THRESHOLD = int(os.getenv('OSS_MULTIPART_THRESHOLD', str(5 * 1024 * 1024)))
+MULTIPART_PART_SIZE = int(os.getenv('OSS_MULTIPART_PART_SIZE', str(1024 * 1024)))
+PART_RETRIES = int(os.getenv('OSS_PART_RETRIES', '3'))
+# Checkpoints of unfinished multipart uploads, so a retry only sends missing parts
+CHECKPOINT_DIR = os.getenv('OSS_CHECKPOINT_DIR', os.path.join('.cache', 'oss_multipart'))
+
+oss2.defaults.connection_pool_size = OSS_POOL_SIZE
+
+upload_executor = ThreadPoolExecutor(max_workers=OSS_UPLOAD_CONCURRENCY, thread_name_prefix="oss-upload")
+# Separate pool for parts: a multipart upload running on upload_executor waits on them
+part_executor = ThreadPoolExecutor(max_workers=OSS_UPLOAD_CONCURRENCY, thread_name_prefix="oss-part")
+
+
+class LocalObject:
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+
+    def read(self, amt=None):
+        return self._f.read() if amt is None else self._f.read(amt)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalResult:
+    def __init__(self, status=200, etag="", upload_id=None, next_position=None):
+        self.status = status
+        self.etag = etag
+        self.upload_id = upload_id
+        self.next_position = next_position
+
+
+class LocalBucket:
+    """
+    Directory-backed stand-in for oss2.Bucket, implementing the subset of its
+    API the app uses. Object keys map to paths under root.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._append_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def put_object(self, key, data, headers=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            if isinstance(data, str):
+                f.write(data.encode('utf-8'))
+            elif isinstance(data, (bytes, bytearray)):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f)
+        os.replace(tmp_path, path)
+        return LocalResult()
+
+    def put_object_from_file(self, key, filename, headers=None):
+        with open(filename, 'rb') as f:
+            return self.put_object(key, f, headers)
+
+    def get_object(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            raise oss2.exceptions.NoSuchKey(404, {}, b'', {'Code': 'NoSuchKey', 'Message': key})
+        return LocalObject(path)
+
+    def append_object(self, key, position, data, headers=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._append_lock:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if position != size:
+                raise oss2.exceptions.PositionNotEqualToLength(
+                    409, {'x-oss-next-append-position': str(size)}, b'',
+                    {'Code': 'PositionNotEqualToLength', 'Message': key})
+            with open(path, 'ab') as f:
+                f.write(data)
+        return LocalResult(next_position=size + len(data))
+
+    def _upload_dir(self, upload_id):
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload id: {upload_id}")
+        return os.path.join(self.root, '.multipart', upload_id)
+
+    def init_multipart_upload(self, key, headers=None):
+        self._path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(upload_id))
+        return LocalResult(upload_id=upload_id)
+
+    def upload_part(self, key, upload_id, part_number, data, headers=None):
+        upload_dir = self._upload_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            raise oss2.exceptions.NoSuchUpload(404, {}, b'', {'Code': 'NoSuchUpload', 'Message': upload_id})
+        part_path = os.path.join(upload_dir, f"{part_number:05d}")
+        with open(f"{part_path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{part_path}.tmp", part_path)
+        return LocalResult(etag=hashlib.md5(data).hexdigest().upper())
+
+    def complete_multipart_upload(self, key, upload_id, parts, headers=None):
+        upload_dir = self._upload_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            raise oss2.exceptions.NoSuchUpload(404, {}, b'', {'Code': 'NoSuchUpload', 'Message': upload_id})
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'wb') as out:
+            for part in sorted(parts, key=lambda p: p.part_number):
+                with open(os.path.join(upload_dir, f"{part.part_number:05d}"), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        os.replace(f"{path}.tmp", path)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return LocalResult()
+
+    def abort_multipart_upload(self, key, upload_id, headers=None):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+        return LocalResult(204)
+
+    def object_exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete_object(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        return LocalResult(204)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_session = None
+
+
+def get_bucket():
+    """
+    Return the receipts bucket: a LocalBucket when OSS_LOCAL_DIR is set, else
+    OSS. Clients are created once per bucket and share one pooled HTTP session,
+    so uploads reuse warm TLS connections.
+    """
+    global _session
+    cache_key = ('local', local_dir) if local_dir else (endpoint, bucket_name)
+    bucket = _buckets.get(cache_key)
+    if bucket is not None:
+        return bucket
+    with _buckets_lock:
+        bucket = _buckets.get(cache_key)
+        if bucket is None:
+            if local_dir:
+                bucket = LocalBucket(local_dir)
+            else:
+                if _session is None:
+                    _session = oss2.Session(pool_size=OSS_POOL_SIZE)
+                auth = oss2.Auth(access_key_id, access_key_secret)
+                bucket = oss2.Bucket(auth, endpoint, bucket_name, session=_session)
+            _buckets[cache_key] = bucket
+    return bucket
+
+
+def _checkpoint_path(key, size, mtime):
+    digest = hashlib.sha256(f"{key}\0{size}\0{mtime}".encode()).hexdigest()
+    return os.path.join(CHECKPOINT_DIR, f"{digest}.json")
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _upload_part(bucket, key, upload_id, filename, part_number, offset, length):
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    for attempt in range(1, PART_RETRIES + 1):
+        try:
+            return bucket.upload_part(key, upload_id, part_number, data).etag
+        except oss2.exceptions.NoSuchUpload:
+            raise
+        except Exception as e:
+            if attempt == PART_RETRIES:
+                raise
+            logger.warning("Retrying part %d of %s after error: %s", part_number, key, e)
+
+
+def multipart_upload(bucket, key, filename, part_size=MULTIPART_PART_SIZE):
+    """
+    Upload a file in parts sent concurrently. Completed parts are checkpointed
+    under CHECKPOINT_DIR, so calling again after a failure resumes the upload.
+    """
+    stat = os.stat(filename)
+    checkpoint_path = _checkpoint_path(key, stat.st_size, stat.st_mtime_ns)
+    checkpoint = _load_checkpoint(checkpoint_path)
+    if not checkpoint or checkpoint.get('part_size') != part_size:
+        checkpoint = {
+            'upload_id': bucket.init_multipart_upload(key).upload_id,
+            'part_size': part_size,
+            'parts': {},
+        }
+        _save_checkpoint(checkpoint_path, checkpoint)
+    upload_id = checkpoint['upload_id']
+
+    pending = {}
+    for part_number, offset in enumerate(range(0, stat.st_size, part_size), start=1):
+        if str(part_number) not in checkpoint['parts']:
+            pending[part_number] = part_executor.submit(
+                _upload_part, bucket, key, upload_id, filename, part_number, offset, part_size)
+    # Record every part that made it, even if another one failed
+    error = None
+    for part_number, future in pending.items():
+        if future.exception() is None:
+            checkpoint['parts'][str(part_number)] = future.result()
+        elif error is None:
+            error = future.exception()
+    if isinstance(error, oss2.exceptions.NoSuchUpload):
+        # The server dropped the upload; start over on the next attempt
+        os.remove(checkpoint_path)
+        raise error
+    _save_checkpoint(checkpoint_path, checkpoint)
+    if error is not None:
+        raise error
+
+    parts = [oss2.models.PartInfo(int(number), etag) for number, etag in checkpoint['parts'].items()]
+    result = bucket.complete_multipart_upload(key, upload_id, sorted(parts, key=lambda p: p.part_number))
+    os.remove(checkpoint_path)
+    return result
+
+
+def upload_file(bucket, key, filename):
+    """Upload a file, as a multipart upload when it exceeds MULTIPART_THRESHOLD"""
+    if os.path.getsize(filename) >= MULTIPART_THRESHOLD:
+        return multipart_upload(bucket, key, filename)
+    with open(filename, 'rb') as f:
+        return bucket.put_object(key, f)
+
+
+def upload_objects(bucket, files=(), objects=()):
+    """
+    Upload (key, filename) files and (key, data) objects concurrently and wait
+    for all of them; the first failure is raised once every upload has settled.
+    """
+    futures = [upload_executor.submit(upload_file, bucket, key, filename) for key, filename in files]
+    futures += [upload_executor.submit(bucket.put_object, key, data) for key, data in objects]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
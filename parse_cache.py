@@ -0,0 +1,116 @@
+# parse_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.getenv("RECEIPT_CACHE_DIR", os.path.join(".cache", "receipt_parse"))
+DEFAULT_MAX_BYTES = int(os.getenv("RECEIPT_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+def make_cache_key(image_bytes: bytes, model: str, prompt_version: str) -> str:
+    """Content-address a parse request by image bytes, model and prompt version"""
+    digest = hashlib.sha256()
+    digest.update(model.encode())
+    digest.update(b"\0")
+    digest.update(prompt_version.encode())
+    digest.update(b"\0")
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed receipts with size-bounded LRU eviction.
+
+    Each entry is one JSON file named after its key. The file mtime doubles as
+    the last-access time, so recency survives restarts without an index file.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        path = self._path(key)
+        with self._lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+                os.utime(path, None)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value under key and evict least recently used entries"""
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("Failed to write parse cache entry %s: %s", key, e)
+                return
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        """Return hit/miss/eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,226 @@
+# receipt_backends.py
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from dashscope_client import call_multimodal, stream_multimodal
+
+logger = logging.getLogger(__name__)
+
+QWEN_VL_MODEL = 'qwen-vl-plus'
+
+
+class BackendError(RuntimeError):
+    """Raised when a backend cannot produce an answer (e.g. a non-200 API status)"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"API call failed with status {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def _build_messages(img_base64, prompt):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"image": img_base64},
+                {"text": prompt}
+            ]
+        }
+    ]
+
+
+class ReceiptBackend:
+    """
+    Turns a receipt image (as a base64 data URL) and the extraction prompt into
+    the model's raw text answer. `model` is part of the parse cache key.
+    """
+
+    model = "base"
+
+    def generate(self, img_base64, prompt):
+        """Return the full answer text"""
+        raise NotImplementedError
+
+    def stream(self, img_base64, prompt):
+        """Yield the answer as text deltas; defaults to a single chunk"""
+        yield self.generate(img_base64, prompt)
+
+
+class QwenVLBackend(ReceiptBackend):
+    """Live Qwen-VL over DashScope"""
+
+    def __init__(self, model=QWEN_VL_MODEL):
+        self.model = model
+
+    def generate(self, img_base64, prompt):
+        response = call_multimodal(model=self.model, messages=_build_messages(img_base64, prompt))
+        if response.status_code != 200:
+            raise BackendError(response.status_code, response.message)
+        return response.output["choices"][0]["message"]["content"][0]["text"]
+
+    def stream(self, img_base64, prompt):
+        for event in stream_multimodal(model=self.model, messages=_build_messages(img_base64, prompt)):
+            if event.status_code != 200:
+                raise BackendError(event.status_code, event.message)
+            yield "".join(part.get("text", "") for part in event.output["choices"][0]["message"]["content"])
+
+
+class StubBackend(ReceiptBackend):
+    """
+    Deterministic offline backend: the same image always yields the same
+    plausible receipt, so pipelines can be exercised without network access.
+    """
+
+    model = "stub-receipt"
+    MERCHANTS = ("Sunway University", "Guardian Pharmacy", "Popular Bookstore", "Decathlon", "Village Grocer")
+    ITEMS = (
+        ("Tuition Fee", "Education"), ("Vitamin C", "Medical"), ("Textbook", "Lifestyle"),
+        ("Badminton Racket", "Sports"), ("Rice 5kg", "Food & Beverage"), ("Health Screening", "Medical"),
+    )
+
+    def __init__(self, latency=0.0, chunk_size=16):
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    def _answer(self, img_base64):
+        seed = int.from_bytes(hashlib.sha256(img_base64.encode()).digest()[:8], "big")
+        rng = random.Random(seed)
+        items = [
+            {"name": name, "price": round(rng.uniform(5, 500), 2), "category": category}
+            for name, category in rng.sample(self.ITEMS, rng.randint(1, 4))
+        ]
+        receipt = {
+            "merchant_name": rng.choice(self.MERCHANTS),
+            "date_of_purchase": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "items": items,
+            "total_amount_spent": round(sum(item["price"] for item in items), 2),
+        }
+        return f"```json\n{json.dumps(receipt, indent=2)}\n```"
+
+    def generate(self, img_base64, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(img_base64)
+
+    def stream(self, img_base64, prompt):
+        text = self.generate(img_base64, prompt)
+        for i in range(0, len(text), self.chunk_size):
+            yield text[i:i + self.chunk_size]
+
+
+class ReplayBackend(ReceiptBackend):
+    """
+    Serves captured model answers from a directory, keyed by request content.
+
+    In "record" mode every request goes to the inner backend and its answer
+    (with stream chunks and latency) is written out; in "replay" mode answers
+    are served from disk with simulated latency, failing on unknown requests.
+    """
+
+    def __init__(self, directory, mode="replay", inner=None, latency=None, jitter=0.0, chunk_delay=0.0):
+        self.directory = directory
+        self.mode = mode
+        self.inner = inner or QwenVLBackend()
+        self.model = self.inner.model
+        # None replays each recording's captured latency
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, img_base64, prompt):
+        digest = hashlib.sha256(f"{self.model}\0{prompt}\0{img_base64}".encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def _save(self, path, text, chunks, elapsed):
+        with self._lock, open(path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "text": text, "chunks": chunks, "latency": elapsed}, f)
+
+    def _load(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BackendError(404, f"No recorded response at {path}") from None
+
+    def _sleep(self, recording):
+        latency = recording.get("latency", 0.0) if self.latency is None else self.latency
+        if self.jitter:
+            latency += random.uniform(0, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def generate(self, img_base64, prompt):
+        path = self._path(img_base64, prompt)
+        if self.mode == "record":
+            started = time.perf_counter()
+            text = self.inner.generate(img_base64, prompt)
+            self._save(path, text, [text], time.perf_counter() - started)
+            return text
+
+        recording = self._load(path)
+        self._sleep(recording)
+        return recording["text"]
+
+    def stream(self, img_base64, prompt):
+        path = self._path(img_base64, prompt)
+        if self.mode == "record":
+            started = time.perf_counter()
+            chunks = []
+            for chunk in self.inner.stream(img_base64, prompt):
+                chunks.append(chunk)
+                yield chunk
+            self._save(path, "".join(chunks), chunks, time.perf_counter() - started)
+            return
+
+        recording = self._load(path)
+        self._sleep(recording)
+        for chunk in recording.get("chunks") or [recording["text"]]:
+            yield chunk
+            if self.chunk_delay:
+                time.sleep(self.chunk_delay)
+
+
+def backend_from_env():
+    """Build the backend selected by RECEIPT_PARSER_BACKEND (qwen, stub, replay or record)"""
+    kind = os.getenv("RECEIPT_PARSER_BACKEND", "qwen").lower()
+    if kind == "stub":
+        return StubBackend(latency=float(os.getenv("RECEIPT_STUB_LATENCY", "0")))
+    if kind in ("replay", "record"):
+        latency = os.getenv("RECEIPT_REPLAY_LATENCY")
+        return ReplayBackend(
+            os.getenv("RECEIPT_REPLAY_DIR", os.path.join("recordings", "receipts")),
+            mode=kind,
+            latency=float(latency) if latency else None,
+            jitter=float(os.getenv("RECEIPT_REPLAY_JITTER", "0")),
+        )
+    if kind != "qwen":
+        raise ValueError(f"Unknown RECEIPT_PARSER_BACKEND: {kind}")
+    if not os.getenv("DASHSCOPE_API_KEY"):
+        logger.warning("DASHSCOPE_API_KEY not found in environment variables; receipt scans will fail")
+    return QwenVLBackend()
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the active receipt backend"""
+    global _backend
+    if _backend is None:
+        _backend = backend_from_env()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the active receipt backend (e.g. a StubBackend for offline runs)"""
+    global _backend
+    _backend = backend
@@ -0,0 +1,160 @@
+# receipt_manifest.py
+
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+import oss2
+
+from oss_store import get_bucket
+from receipt_schema import parse_amount, parse_date
+
+logger = logging.getLogger(__name__)
+
+# Receipts are filed under this user until the app has real accounts
+DEFAULT_USER_ID = os.getenv('TAXY_USER_ID', 'default')
+
+MANIFEST_PREFIX = 'manifests'
+# Fold the append log into the base manifest once it grows past this many bytes
+COMPACT_BYTES = int(os.getenv('RECEIPT_MANIFEST_COMPACT_BYTES', str(64 * 1024)))
+
+
+def manifest_keys(user_id, year):
+    """Object keys of the compacted base manifest and its append log"""
+    prefix = f"{MANIFEST_PREFIX}/{user_id}/{year}"
+    return f"{prefix}/manifest.jsonl", f"{prefix}/log.jsonl"
+
+
+def receipt_year(receipt_data, uploaded_at):
+    """Tax year of a receipt: its purchase date, else the upload date"""
+    purchased = parse_date(receipt_data.get("Date of purchase"))
+    return purchased.year if purchased else uploaded_at.year
+
+
+def manifest_row(receipt_data, receipt_id, image_key, data_key, uploaded_at):
+    """One manifest row from the receipt dict shown in the edit form"""
+    purchased = parse_date(receipt_data.get("Date of purchase"))
+    total = parse_amount(receipt_data.get("Total amount spent"))
+
+    categories = defaultdict(Decimal)
+    for price, category in zip(receipt_data.get("Item price", []), receipt_data.get("Item category", [])):
+        amount = parse_amount(price)
+        if amount is not None:
+            categories[category.strip() or "Uncategorised"] += amount
+    if not categories and total is not None:
+        categories["Uncategorised"] = total
+
+    return {
+        "receipt_id": receipt_id,
+        "merchant": receipt_data.get("Merchant name", ""),
+        "date": purchased.isoformat() if purchased else "",
+        "total": "" if total is None else str(total),
+        # Category with the most spend on the receipt
+        "category": max(categories, key=categories.get) if categories else "",
+        "categories": {name: str(amount) for name, amount in categories.items()},
+        "image_key": image_key,
+        "data_key": data_key,
+        "uploaded_at": uploaded_at.isoformat(timespec="seconds"),
+    }
+
+
+def _read_text(bucket, key):
+    try:
+        obj = bucket.get_object(key)
+    except oss2.exceptions.NoSuchKey:
+        return ""
+    try:
+        return obj.read().decode('utf-8')
+    finally:
+        obj.close()
+
+
+def _parse_rows(text):
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            # A torn append leaves at most one bad line; skip it
+            logger.warning("Skipping unreadable manifest line: %.80s", line)
+    return rows
+
+
+def _dumps(rows):
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+class ReceiptManifest:
+    """
+    Per-user, per-tax-year receipt index stored next to the receipts in OSS.
+
+    New rows are appended to an appendable log object; once the log passes
+    COMPACT_BYTES it is merged into the base manifest and removed. Reading a
+    year costs two small GETs. Compaction assumes a single writer per user.
+    """
+
+    def __init__(self, bucket=None):
+        self._bucket = bucket
+        self._locks = defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
+        # Next append offset of each log, learned from the last append
+        self._positions = {}
+
+    @property
+    def bucket(self):
+        return self._bucket or get_bucket()
+
+    def _lock(self, user_id, year):
+        with self._locks_guard:
+            return self._locks[(user_id, year)]
+
+    def append(self, user_id, year, row):
+        """Append one receipt row, compacting the log when it has grown large"""
+        base_key, log_key = manifest_keys(user_id, year)
+        line = json.dumps(row, ensure_ascii=False) + "\n"
+        with self._lock(user_id, year):
+            position = self._positions.get(log_key, 0)
+            try:
+                result = self.bucket.append_object(log_key, position, line)
+            except oss2.exceptions.PositionNotEqualToLength as e:
+                result = self.bucket.append_object(log_key, e.next_position, line)
+            self._positions[log_key] = result.next_position
+            if result.next_position >= COMPACT_BYTES:
+                self._compact(user_id, year)
+
+    def read(self, user_id, year):
+        """All rows for a user and year, newest upload of each receipt winning"""
+        base_key, log_key = manifest_keys(user_id, year)
+        rows = {}
+        for row in _parse_rows(_read_text(self.bucket, base_key)) + _parse_rows(_read_text(self.bucket, log_key)):
+            rows[row["receipt_id"]] = row
+        return sorted(rows.values(), key=lambda row: (row["date"], row["uploaded_at"]))
+
+    def compact(self, user_id, year):
+        """Merge the append log into the base manifest"""
+        with self._lock(user_id, year):
+            self._compact(user_id, year)
+
+    def _compact(self, user_id, year):
+        base_key, log_key = manifest_keys(user_id, year)
+        rows = self.read(user_id, year)
+        self.bucket.put_object(base_key, _dumps(rows))
+        self.bucket.delete_object(log_key)
+        self._positions[log_key] = 0
+        logger.info("Compacted manifest %s (%d receipts)", base_key, len(rows))
+
+
+manifest = ReceiptManifest()
+
+
+def record_receipt(user_id, receipt_data, receipt_id, image_key, data_key, uploaded_at):
+    """Index an uploaded receipt in its owner's manifest for the receipt's tax year"""
+    row = manifest_row(receipt_data, receipt_id, image_key, data_key, uploaded_at)
+    manifest.append(user_id, receipt_year(receipt_data, uploaded_at), row)
+    return row
+
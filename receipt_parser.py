@@ -1,133 +1,291 @@
 # receipt_parser.py
 
-import dashscope
 import os
-from PIL import Image
+from PIL import Image, ImageOps
 import base64
 from io import BytesIO
-import json
-import logging
 from dotenv import load_dotenv
+from parse_cache import parse_cache, make_cache_key
+from receipt_backends import BackendError, get_backend
+from receipt_schema import IncrementalReceiptParser, extract_receipt, validate_receipt
+from log_utils import capture_payload, configure_logging, get_logger, log_event
+from single_flight import SingleFlight
 
 # Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+configure_logging()
+logger = get_logger(__name__)
 
 load_dotenv()
 
-# Configure DashScope with API key from environment
-api_key = os.getenv("DASHSCOPE_API_KEY")
-if not api_key:
-    raise ValueError("DASHSCOPE_API_KEY not found in environment variables")
+# The model call itself is delegated to a pluggable backend (see receipt_backends)
+# Bump PROMPT_VERSION whenever RECEIPT_PROMPT or the extracted format changes so cached parses are not reused
+PROMPT_VERSION = "2"
+RECEIPT_PROMPT = (
+    "Extract the following information from this receipt image and format it as a JSON format:\n"
+    "- merchant_name (store name)\n"
+    "- date_of_purchase\n"
+    "- items (array of objects with name, price, and category)\n"
+    "- total_amount_spent\n"
+)
 
-logger.info("Configuring DashScope with API key")
-dashscope.api_key = api_key
-dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
+# Image preprocessing applied before the receipt is sent to Qwen-VL
+MAX_LONG_EDGE = int(os.getenv("RECEIPT_MAX_LONG_EDGE", "1600"))
+JPEG_BYTE_BUDGET = int(os.getenv("RECEIPT_JPEG_BYTE_BUDGET", str(300 * 1024)))
+GRAYSCALE = os.getenv("RECEIPT_GRAYSCALE", "0") == "1"
+AUTOCONTRAST = os.getenv("RECEIPT_AUTOCONTRAST", "0") == "1"
+JPEG_QUALITIES = (90, 85, 80, 75, 70, 60, 50, 40)
 
-def image_to_base64(image: Image.Image) -> str:
-    """Convert PIL Image to base64 string"""
+# Concurrent parses of the same image (same cache key: bytes, model, prompt version) share one model call
+receipt_flight = SingleFlight("receipt_parse")
+
+# Running totals of bytes before/after normalisation, to track upload savings
+upload_stats = {"images": 0, "bytes_before": 0, "bytes_after": 0}
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
     buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return buffered.getvalue()
+
+def normalize_image(image: Image.Image, original_size: int = None, max_long_edge: int = MAX_LONG_EDGE,
+                    byte_budget: int = JPEG_BYTE_BUDGET, grayscale: bool = GRAYSCALE,
+                    autocontrast: bool = AUTOCONTRAST):
+    """
+    Prepare a receipt photo for the VLM: fix orientation, convert mode, downscale
+    and pick the highest JPEG quality that fits the byte budget
+    Args:
+        image (PIL.Image): Receipt image as opened from the upload
+        original_size (int): Size in bytes of the uploaded file, for reporting
+    Returns:
+        tuple: (jpeg bytes, stats dict with before/after sizes)
+    """
+    original_dims = image.size
+
+    # Let the JPEG decoder skip detail we are about to throw away
+    long_edge = max(image.size)
+    if image.format == "JPEG" and long_edge > max_long_edge:
+        scale = max_long_edge / long_edge
+        image.draft("RGB", (int(image.width * scale) + 1, int(image.height * scale) + 1))
+
+    image = ImageOps.exif_transpose(image)
+
+    # JPEG cannot store alpha or palettes, so flatten onto white
+    if image.mode in ("RGBA", "LA", "P", "PA"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    if grayscale:
+        image = image.convert("L")
+    if autocontrast:
+        image = ImageOps.autocontrast(image, cutoff=1)
+
+    long_edge = max(image.size)
+    if long_edge > max_long_edge:
+        scale = max_long_edge / long_edge
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.LANCZOS
+        )
+
+    # Binary search the quality ladder for the best quality within budget
+    lo, hi = 0, len(JPEG_QUALITIES) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        data = _encode_jpeg(image, JPEG_QUALITIES[mid])
+        if len(data) <= byte_budget:
+            best = (data, JPEG_QUALITIES[mid])
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    if best is None:
+        # Nothing fits the budget; the last attempt was already the lowest quality
+        best = (data, JPEG_QUALITIES[-1])
+    jpeg_bytes, quality = best
+
+    stats = {
+        "original_dims": original_dims,
+        "final_dims": image.size,
+        "quality": quality,
+        "bytes_before": original_size,
+        "bytes_after": len(jpeg_bytes),
+    }
+    return jpeg_bytes, stats
+
+def image_to_base64(image: Image.Image, original_size: int = None) -> str:
+    """Normalise PIL Image and convert it to a base64 data URL"""
+    jpeg_bytes, stats = normalize_image(image, original_size)
+
+    upload_stats["images"] += 1
+    upload_stats["bytes_after"] += stats["bytes_after"]
+    if stats["bytes_before"]:
+        upload_stats["bytes_before"] += stats["bytes_before"]
+    log_event(
+        logger, "receipt.image.normalised",
+        dims_before=stats["original_dims"], dims_after=stats["final_dims"], quality=stats["quality"],
+        bytes_before=stats["bytes_before"], bytes_after=stats["bytes_after"]
+    )
+
+    img_str = base64.b64encode(jpeg_bytes).decode()
     return f"data:image/jpeg;base64,{img_str}"
 
-def parse_receipt_qwen(image: Image.Image):
+def _error_result(label: str, error_msg: str):
+    return {
+        "Merchant name": label,
+        "Date of purchase": "",
+        "Item name": [],
+        "Item price": [],
+        "Item category": [],
+        "Total amount spent": "",
+        "error": error_msg
+    }
+
+def _format_receipt(receipt):
+    """Transform a validated Receipt into the UI's expected format"""
+    formatted_data = {
+        "Merchant name": receipt.merchant,
+        "Date of purchase": receipt.date.isoformat() if receipt.date else receipt.date_text,
+        "Item name": [],
+        "Item price": [],
+        "Item category": [],
+        "Total amount spent": "" if receipt.total is None else str(receipt.total)
+    }
+    
+    # Extract items information
+    for item in receipt.items:
+        formatted_data["Item name"].append(item.name)
+        formatted_data["Item price"].append("" if item.price is None else str(item.price))
+        formatted_data["Item category"].append(item.category)
+    return formatted_data
+
+def _extract_result(result: str):
+    """Recover the receipt from the full model answer and convert it to UI format"""
+    receipt = extract_receipt(result)
+    capture_payload(logger, "receipt.extracted", receipt)
+    return _format_receipt(receipt)
+
+def parse_receipt_qwen(image: Image.Image, image_bytes: bytes = None, backend=None):
     """
     Parse receipt using Qwen-VL model via DashScope API
     Args:
         image (PIL.Image): Receipt image
+        image_bytes (bytes): Original file contents, used as the cache key.
+            Falls back to the decoded pixel data when not given.
+        backend (ReceiptBackend): Backend to use instead of the active one
     Returns:
         dict: Structured data from receipt
     """
-    logger.info("Starting receipt parsing with Qwen-VL")
-
-    prompt = (
-        "Extract the following information from this receipt image and format it as a JSON format:\n"
-        "- merchant_name (store name)\n"
-        "- date_of_purchase\n"
-        "- items (array of objects with name, price, and category)\n"
-        "- total_amount_spent\n"
-    )
+    backend = backend or get_backend()
+
+    if image_bytes is None:
+        image_bytes = image.tobytes()
+    cache_key = make_cache_key(image_bytes, backend.model, PROMPT_VERSION)
+    cached = parse_cache.get(cache_key)
+    if cached is not None:
+        log_event(logger, "receipt.parse.cache_hit", key=cache_key[:12])
+        return cached
+    return receipt_flight.do(cache_key, _parse_uncached, image, image_bytes, backend, cache_key)
+
+def _parse_uncached(image, image_bytes, backend, cache_key):
+    # A parse that finished just before this one started has already cached the receipt
+    cached = parse_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
         # Convert image to base64
-        img_base64 = image_to_base64(image)
-        logger.info("Image converted to base64")
+        img_base64 = image_to_base64(image, original_size=len(image_bytes))
         
-        # Call API
-        logger.info("Calling DashScope API")
-        response = dashscope.MultiModalConversation.call(
-            model='qwen-vl-plus',
-            messages=[
-                {
-                    "role": "user", 
-                    "content": [
-                        {"image": img_base64},
-                        {"text": prompt}
-                    ]
-                }
-            ]
+        # Call the model
+        result = backend.generate(img_base64, RECEIPT_PROMPT)
+        capture_payload(logger, "receipt.parse.raw", result)
+        
+        formatted_data = _extract_result(result)
+        log_event(
+            logger, "receipt.parse.done", model=backend.model,
+            items=len(formatted_data["Item name"]), response_chars=len(result)
         )
+        parse_cache.put(cache_key, formatted_data)
+        return formatted_data
 
-        logger.info(f"Response: {response}")
+    except BackendError as e:
+        logger.error(str(e))
+        return _error_result("API Error", str(e))
 
-        if response.status_code == 200:
-            logger.info("Received successful response from API")
-            
-            # Get the response text from the first item
-            result = response.output.choices[0].message.content[0]['text']
-            logger.info(f"Raw API response: {result}")
-            
-            # Extract JSON string from the markdown code block
-            json_str = result.split("```json\n")[1].split("\n```")[0]
-            logger.info(f"Extracted JSON string: {json_str}")
-            
-            # Parse the JSON string
-            parsed_data = json.loads(json_str)
-            logger.info(f"Parsed JSON data: {parsed_data}")
-            
-            # Transform the data into the UI's expected format
-            formatted_data = {
-                "Merchant name": parsed_data["merchant_name"],
-                "Date of purchase": parsed_data["date_of_purchase"],
-                "Item name": [],
-                "Item price": [],
-                "Item category": [],
-                "Total amount spent": str(parsed_data["total_amount_spent"])
-            }
-            
-            # Extract items information
-            for item in parsed_data["items"]:
-                formatted_data["Item name"].append(item["name"])
-                formatted_data["Item price"].append(str(item["price"]))
-                formatted_data["Item category"].append(item["category"])
-            
-            logger.info(f"Formatted data for UI: {formatted_data}")
-            return formatted_data
+    except Exception as e:
+        error_msg = f"Error processing receipt: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        return _error_result("Processing Error", error_msg)
+
+def stream_receipt_qwen(image: Image.Image, image_bytes: bytes = None, backend=None):
+    """
+    Parse receipt with Qwen-VL incremental output, yielding fields as they arrive
+    Args:
+        image (PIL.Image): Receipt image
+        image_bytes (bytes): Original file contents, used as the cache key
+        backend (ReceiptBackend): Backend to use instead of the active one
+    Yields:
+        tuple: (dict in parse_receipt_qwen's format, done flag). Partial dicts
+            only contain the fields decoded so far; the final one is complete.
+    """
+    backend = backend or get_backend()
+
+    if image_bytes is None:
+        image_bytes = image.tobytes()
+    cache_key = make_cache_key(image_bytes, backend.model, PROMPT_VERSION)
+    cached = parse_cache.get(cache_key)
+    if cached is not None:
+        log_event(logger, "receipt.parse.cache_hit", key=cache_key[:12], stream=True)
+        yield cached, True
+        return
+
+    flight, leader = receipt_flight.begin(cache_key)
+    if not leader:
+        # The same image is already being parsed: wait for that answer instead of streaming another
+        log_event(logger, "receipt.parse.shared", key=cache_key[:12], stream=True)
+        shared = flight.result()
+        # None means that parse was abandoned midway
+        yield (shared if shared is not None else parse_receipt_qwen(image, image_bytes, backend)), True
+        return
+
+    formatted_data = None
+    try:
+        img_base64 = image_to_base64(image, original_size=len(image_bytes))
+        
+        chunks = []
+        incremental = IncrementalReceiptParser()
+        last_partial = _format_receipt(validate_receipt({}))
+        for delta in backend.stream(img_base64, RECEIPT_PROMPT):
+            chunks.append(delta)
             
-        else:
-            error_msg = f"API call failed with status {response.status_code}: {response.message}"
-            logger.error(error_msg)
-            return {
-                "Merchant name": "API Error",
-                "Date of purchase": "",
-                "Item name": [],
-                "Item price": [],
-                "Item category": [],
-                "Total amount spent": "",
-                "error": error_msg
-            }
+            partial = _format_receipt(validate_receipt(incremental.feed(delta)))
+            if partial != last_partial:
+                last_partial = partial
+                yield partial, False
+
+        result = "".join(chunks)
+        capture_payload(logger, "receipt.parse.raw", result)
+        formatted_data = _extract_result(result)
+        log_event(
+            logger, "receipt.parse.done", model=backend.model, stream=True,
+            items=len(formatted_data["Item name"]), chunks=len(chunks)
+        )
+        parse_cache.put(cache_key, formatted_data)
+
+    except BackendError as e:
+        logger.error(str(e))
+        formatted_data = _error_result("API Error", str(e))
 
     except Exception as e:
         error_msg = f"Error processing receipt: {str(e)}"
         logger.error(error_msg, exc_info=True)
-        return {
-            "Merchant name": "Processing Error",
-            "Date of purchase": "",
-            "Item name": [],
-            "Item price": [],
-            "Item category": [],
-            "Total amount spent": "",
-            "error": error_msg
-        }
-            
\ No newline at end of file
+        formatted_data = _error_result("Processing Error", error_msg)
+
+    finally:
+        # Waiting callers get the answer before this generator's consumer does
+        receipt_flight.finish(cache_key, flight, formatted_data)
+
+    yield formatted_data, True
@@ -0,0 +1,283 @@
+# receipt_schema.py
+
+import ast
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptExtractionError(ValueError):
+    """Raised when no receipt JSON can be recovered from a model answer"""
+
+
+@dataclass(slots=True, frozen=True)
+class ReceiptItem:
+    name: str
+    price: Decimal | None
+    category: str
+
+
+@dataclass(slots=True, frozen=True)
+class Receipt:
+    merchant: str
+    date: date | None
+    items: tuple[ReceiptItem, ...]
+    total: Decimal | None
+    # The date exactly as the model wrote it, kept when it cannot be parsed
+    date_text: str = ""
+
+
+# --- Failure-rate counters ---
+extraction_stats = {"attempts": 0, "failures": 0, "repaired": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        extraction_stats[key] += 1
+
+
+def failure_rate():
+    """Fraction of extraction attempts that could not be recovered"""
+    attempts = extraction_stats["attempts"]
+    return extraction_stats["failures"] / attempts if attempts else 0.0
+
+
+# --- Field parsing ---
+# Optional sign, the number, and a trailing minus as printed on refund and discount lines
+_AMOUNT = re.compile(r"(-?)(\d[\d,]*(?:\.\d+)?|\.\d+)(-?)")
+
+DATE_FORMATS = (
+    "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d",
+    "%d/%m/%y", "%d-%m-%y", "%d %b %Y", "%d %B %Y", "%d-%b-%Y",
+    "%b %d, %Y", "%B %d, %Y", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M",
+)
+
+
+def parse_amount(value):
+    """Parse 12.5, "RM 12.50", "MYR1,234.00" or "12.50-" into a Decimal"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    match = _AMOUNT.search(str(value))
+    if not match:
+        return None
+    try:
+        amount = Decimal(match.group(2).replace(",", ""))
+    except InvalidOperation:
+        return None
+    return -amount if match.group(1) or match.group(3) else amount
+
+
+def parse_date(value):
+    """Parse common receipt date layouts (day-first, as printed in Malaysia)"""
+    if not value:
+        return None
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _first(data, *keys, default=None):
+    for key in keys:
+        if key in data and data[key] is not None:
+            return data[key]
+    return default
+
+
+def validate_receipt(data):
+    """Validate a decoded JSON object into a Receipt"""
+    if not isinstance(data, dict):
+        raise ReceiptExtractionError(f"Expected a JSON object, got {type(data).__name__}")
+
+    items = []
+    for raw in _first(data, "items", "line_items", default=[]) or []:
+        if not isinstance(raw, dict):
+            continue
+        items.append(ReceiptItem(
+            name=str(_first(raw, "name", "item", "description", default="")).strip(),
+            price=parse_amount(_first(raw, "price", "amount", "total")),
+            category=str(_first(raw, "category", default="")).strip(),
+        ))
+
+    date_text = str(_first(data, "date_of_purchase", "date", "purchase_date", default="")).strip()
+    return Receipt(
+        merchant=str(_first(data, "merchant_name", "merchant", "store_name", "store", default="")).strip(),
+        date=parse_date(date_text),
+        items=tuple(items),
+        total=parse_amount(_first(data, "total_amount_spent", "total_amount", "total")),
+        date_text=date_text,
+    )
+
+
+# --- JSON recovery ---
+_FENCE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", re.S)
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_BARE_CURRENCY = re.compile(r'(:\s*)((?:RM|MYR|USD|\$)\s*-?[\d,]+(?:\.\d+)?)(\s*[,}\]\n])')
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def _json_span(text):
+    """Return the first JSON object in text, closing it off if the answer was truncated"""
+    start = text.find("{")
+    if start < 0:
+        raise ReceiptExtractionError("No JSON object found in model answer")
+    scanner = _JSONScanner()
+    end = scanner.feed(text, start)
+    return text[start:end] if end else scanner.closed_prefix(text, start)
+
+
+def repair_json(text):
+    """Fix defects models commonly emit: trailing commas, bare currency amounts, smart quotes"""
+    text = text.translate(_SMART_QUOTES)
+    text = _BARE_CURRENCY.sub(r'\1"\2"\3', text)
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+
+def _loads(text):
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+    repaired = repair_json(text)
+    try:
+        return json.loads(repaired), True
+    except ValueError:
+        pass
+    # Last resort: Python-literal style answers with single quotes
+    literal = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", re.sub(r"\bnull\b", "None", repaired)))
+    try:
+        return ast.literal_eval(literal), True
+    except (ValueError, SyntaxError) as e:
+        raise ReceiptExtractionError(f"Could not decode receipt JSON: {e}") from e
+
+
+def extract_receipt(text):
+    """
+    Recover a Receipt from a fenced, unfenced or chatty model answer
+    Args:
+        text (str): Raw model output
+    Returns:
+        Receipt: Validated receipt record
+    Raises:
+        ReceiptExtractionError: If nothing usable can be recovered
+    """
+    _count("attempts")
+    try:
+        fenced = _FENCE.search(text)
+        body = fenced.group(1) if fenced and "{" in fenced.group(1) else text
+        data, repaired = _loads(_json_span(body))
+        receipt = validate_receipt(data)
+    except ReceiptExtractionError:
+        _count("failures")
+        raise
+    if repaired:
+        _count("repaired")
+        logger.info("Repaired malformed receipt JSON")
+    return receipt
+
+
+# --- Incremental parsing for streamed answers ---
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class _JSONScanner:
+    """
+    Resumable scanner over JSON text that remembers the last point where a
+    complete value ended, plus the brackets still open at that point.
+    """
+
+    __slots__ = ("in_string", "escape", "stack", "safe", "safe_stack")
+
+    def __init__(self):
+        self.in_string = False
+        self.escape = False
+        self.stack = []
+        self.safe = 0
+        self.safe_stack = []
+
+    def feed(self, text, start=0):
+        """Scan text[start:]; return the end index of the root object once it closes"""
+        for i in range(start, len(text)):
+            ch = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.stack.append(ch)
+            elif ch in "}]":
+                if self.stack:
+                    self.stack.pop()
+                self.safe, self.safe_stack = i + 1, list(self.stack)
+                if not self.stack:
+                    return i + 1
+            elif ch == ",":
+                self.safe, self.safe_stack = i, list(self.stack)
+        return None
+
+    def closed_prefix(self, text, start=0):
+        """The longest complete-value prefix of text[start:], with open brackets closed"""
+        return text[start:self.safe] + "".join(_CLOSERS[b] for b in reversed(self.safe_stack))
+
+
+class IncrementalReceiptParser:
+    """
+    Feed streamed text deltas; after each one, get back the receipt fields
+    that are already complete. Only new characters are scanned per delta.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._start = None
+        self._scanned = 0
+        self._end = None
+        self._scanner = _JSONScanner()
+        self._last_safe = 0
+        self.fields = {}
+
+    def feed(self, delta):
+        """Add a text delta and return the dict of fields decoded so far"""
+        self.buffer += delta
+        if self._start is None:
+            self._start = self.buffer.find("{")
+            if self._start < 0:
+                self._start = None
+                return self.fields
+            self._scanned = self._start
+
+        if self._end is None:
+            self._end = self._scanner.feed(self.buffer, self._scanned)
+        self._scanned = len(self.buffer)
+        if self._scanner.safe == self._last_safe:
+            return self.fields
+        self._last_safe = self._scanner.safe
+
+        try:
+            data, _ = _loads(self._scanner.closed_prefix(self.buffer, self._start))
+        except ReceiptExtractionError:
+            return self.fields
+        if not isinstance(data, dict):
+            return self.fields
+
+        # Still inside a line item object (root -> items -> item): hold it back until it closes
+        if len(self._scanner.safe_stack) >= 3 and isinstance(data.get("items"), list) and data["items"]:
+            data["items"] = data["items"][:-1]
+        self.fields = data
+        return self.fields
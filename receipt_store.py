@@ -0,0 +1,188 @@
+# receipt_store.py
+
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from receipt_manifest import DEFAULT_USER_ID, receipt_year
+from receipt_schema import parse_amount, parse_date
+from relief_categories import relief_section
+
+logger = logging.getLogger(__name__)
+
+RECEIPT_DB_PATH = os.getenv('RECEIPT_DB_PATH', os.path.join('data', 'receipts.db'))
+# Confirmed receipt images are copied here; Gradio's upload temp files do not last
+RECEIPT_IMAGE_DIR = os.getenv('RECEIPT_IMAGE_DIR', os.path.join('data', 'images'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    receipt_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER,
+    date TEXT,
+    merchant TEXT,
+    total_cents INTEGER,
+    image_path TEXT,
+    image_key TEXT,
+    data_key TEXT,
+    uploaded_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    receipt_id TEXT NOT NULL REFERENCES receipts(receipt_id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER,
+    name TEXT,
+    category TEXT NOT NULL,
+    relief TEXT NOT NULL,
+    amount_cents INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_receipts_user_year_date ON receipts(user_id, year, date);
+CREATE INDEX IF NOT EXISTS idx_items_user_year_category ON items(user_id, year, category);
+CREATE INDEX IF NOT EXISTS idx_items_user_year_relief ON items(user_id, year, relief);
+CREATE INDEX IF NOT EXISTS idx_items_receipt ON items(receipt_id);
+"""
+
+
+def _cents(amount):
+    return None if amount is None else int((amount * 100).to_integral_value())
+
+
+def _amount(cents):
+    return Decimal(cents or 0) / 100
+
+
+class ReceiptStore:
+    """
+    Embedded SQLite store of confirmed receipts and their items. Amounts are
+    kept in integer cents so aggregates are exact and computed by SQLite.
+    Each thread gets its own connection; WAL lets readers run during writes.
+    """
+
+    def __init__(self, path=RECEIPT_DB_PATH, image_dir=RECEIPT_IMAGE_DIR):
+        self.path = path
+        self.image_dir = image_dir
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _keep_image(self, image_path, receipt_id):
+        if not image_path or not os.path.exists(image_path):
+            return None
+        os.makedirs(self.image_dir, exist_ok=True)
+        kept = os.path.join(self.image_dir, f"{receipt_id}{os.path.splitext(image_path)[1] or '.jpg'}")
+        shutil.copyfile(image_path, kept)
+        return kept
+
+    def add_receipt(self, receipt_data, receipt_id, image_path=None, user_id=DEFAULT_USER_ID,
+                    image_key=None, data_key=None, uploaded_at=None):
+        """Insert (or replace) a confirmed receipt given the edit form's receipt dict"""
+        uploaded_at = uploaded_at or datetime.now()
+        purchased = parse_date(receipt_data.get("Date of purchase"))
+        year = receipt_year(receipt_data, uploaded_at)
+        month = purchased.month if purchased else None
+        items = [
+            (receipt_id, user_id, year, month, name.strip(), category.strip() or "Uncategorised",
+             relief_section(name, category), _cents(parse_amount(price)))
+            for name, price, category in zip(receipt_data.get("Item name", []),
+                                              receipt_data.get("Item price", []),
+                                              receipt_data.get("Item category", []))
+        ]
+        kept_image = self._keep_image(image_path, receipt_id)
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM receipts WHERE receipt_id = ?", (receipt_id,))
+            conn.execute(
+                "INSERT INTO receipts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (receipt_id, user_id, year, month, purchased.isoformat() if purchased else None,
+                 receipt_data.get("Merchant name", ""), _cents(parse_amount(receipt_data.get("Total amount spent"))),
+                 kept_image, image_key, data_key, uploaded_at.isoformat(timespec="seconds")),
+            )
+            conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?)", items)
+
+    def _grouped(self, column, user_id, year):
+        rows = self._connect().execute(
+            f"SELECT {column} AS key, SUM(amount_cents) AS cents FROM items "
+            f"WHERE user_id = ? AND year = ? GROUP BY {column} ORDER BY cents DESC",
+            (user_id, year),
+        )
+        return {row["key"]: _amount(row["cents"]) for row in rows}
+
+    def totals_by_category(self, user_id=DEFAULT_USER_ID, year=None):
+        """Item spend per category for a tax year"""
+        return self._grouped("category", user_id, year or datetime.now().year)
+
+    def totals_by_relief(self, user_id=DEFAULT_USER_ID, year=None):
+        """Item spend per relief bucket for a tax year"""
+        return self._grouped("relief", user_id, year or datetime.now().year)
+
+    def item_rows(self, user_id=DEFAULT_USER_ID, year=None):
+        """(receipt_id, name, category, amount_cents) of every line item in a tax year"""
+        return self._connect().execute(
+            "SELECT receipt_id, name, category, amount_cents FROM items WHERE user_id = ? AND year = ?",
+            (user_id, year or datetime.now().year),
+        ).fetchall()
+
+    def totals_by_month(self, user_id=DEFAULT_USER_ID, year=None):
+        """Receipt totals per month (1-12) for a tax year"""
+        rows = self._connect().execute(
+            "SELECT month, SUM(total_cents) AS cents FROM receipts "
+            "WHERE user_id = ? AND year = ? AND month IS NOT NULL GROUP BY month ORDER BY month",
+            (user_id, year or datetime.now().year),
+        )
+        return {row["month"]: _amount(row["cents"]) for row in rows}
+
+    def recent_transactions(self, user_id=DEFAULT_USER_ID, year=None, limit=10):
+        """Latest receipts of a tax year with their main category, newest first"""
+        rows = self._connect().execute(
+            """
+            SELECT r.receipt_id, r.date, r.merchant, r.total_cents, r.image_path,
+                   (SELECT category FROM items i WHERE i.receipt_id = r.receipt_id
+                    ORDER BY amount_cents DESC LIMIT 1) AS category,
+                   (SELECT relief FROM items i WHERE i.receipt_id = r.receipt_id
+                    ORDER BY amount_cents DESC LIMIT 1) AS relief
+            FROM receipts r
+            WHERE r.user_id = ? AND r.year = ?
+            ORDER BY r.date DESC, r.uploaded_at DESC
+            LIMIT ?
+            """,
+            (user_id, year or datetime.now().year, limit),
+        )
+        return [
+            {**dict(row), "total": None if row["total_cents"] is None else _amount(row["total_cents"])}
+            for row in rows
+        ]
+
+    def images_by_category(self, user_id=DEFAULT_USER_ID, year=None):
+        """(image_key, image_path) of stored receipts per item category, for the receipt galleries"""
+        rows = self._connect().execute(
+            "SELECT DISTINCT i.category, r.image_key, r.image_path FROM items i JOIN receipts r USING (receipt_id) "
+            "WHERE i.user_id = ? AND i.year = ? AND COALESCE(r.image_key, r.image_path) IS NOT NULL "
+            "ORDER BY i.category, r.date",
+            (user_id, year or datetime.now().year),
+        )
+        images = {}
+        for row in rows:
+            images.setdefault(row["category"], []).append((row["image_key"] or row["image_path"], row["image_path"]))
+        return images
+
+
+receipt_store = ReceiptStore()
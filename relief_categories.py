@@ -0,0 +1,105 @@
+# relief_categories.py
+
+import numpy as np
+import pandas as pd
+
+# LHDN personal reliefs shown on the Tax Deduction page: (section, relief, cap in RM, shared limit)
+RELIEFS = (
+    ("Self, Parents & Spouse", "Automatic Individual Relief", 9000, None),
+    ("Self, Parents & Spouse", "Medical Expenses For Parents", 8000, None),
+    ("Self, Parents & Spouse", "Spouse/Alimony", 4000, None),
+    ("Education", "Education Fees in Malaysia", 7000, "education_fees"),
+    ("Education", "Upskilling/Self-Enhancement Courses", 2000, "education_fees"),
+    ("Medical", "Serious Disease/Vaccination", 8000, "medical"),
+    ("Medical", "Fertility Treatment", 5000, "medical"),
+    ("Medical", "Medical & Mental Health Exam", 1000, "medical"),
+    ("Medical", "Rehabilitation for Learning Disabilities", 3000, "medical"),
+    ("Lifestyle", "Lifestyle Purchases", 2500, None),
+    ("Lifestyle", "Sports Activity Expenses", 500, None),
+    ("Lifestyle", "EV Charging Equipment", 2500, None),
+    ("Parenthood", "Breastfeeding Equipment", 1000, None),
+    ("Parenthood", "Childcare Fees", 3000, None),
+    ("Parenthood", "SSPN Deposit", 8000, None),
+    ("Parenthood", "Child Relief", 2000, None),
+    ("Parenthood", "Child 18+ in Full-Time Education", 2000, None),
+    ("Parenthood", "Child 18+ in Tertiary Education", 8000, None),
+    ("Insurance & Investment", "Life Insurance (Non-Public Servants)", 3000, "life_epf"),
+    ("Insurance & Investment", "EPF (Statutory & Voluntary)", 4000, "life_epf"),
+    ("Insurance & Investment", "PRS & Deferred Annuity", 3000, None),
+    ("Insurance & Investment", "Education and Medical Insurance", 3000, None),
+    ("Insurance & Investment", "SOCSO", 350, None),
+    ("Disabled Persons", "Equipment for Disabled", 6000, None),
+    ("Disabled Persons", "Disabled Individual", 6000, None),
+    ("Disabled Persons", "Disabled Spouse", 5000, None),
+    ("Disabled Persons", "Disabled Child", 6000, None),
+    ("Disabled Persons", "Disabled Child 18+ in Education/Training", 8000, None),
+)
+
+# Limits shared by several reliefs: upskilling sits inside the education fees limit,
+# the medical reliefs for self, spouse and child share one limit, and so do life insurance and EPF
+GROUP_CAPS = {
+    "education_fees": 7000,
+    "medical": 10000,
+    "life_epf": 7000,
+}
+
+SECTION_ICONS = {
+    "Self, Parents & Spouse": "👪",
+    "Education": "🎓",
+    "Medical": "🏥",
+    "Lifestyle": "🎮",
+    "Parenthood": "👶",
+    "Insurance & Investment": "💼",
+    "Disabled Persons": "♿",
+}
+
+NON_DEDUCTIBLE = "Non-deductible"
+
+# Receipt line item text ("<item name> <category>") -> relief; first match wins
+RELIEF_RULES = (
+    (r"medical insurance|education insurance|takaful", "Education and Medical Insurance"),
+    (r"life insurance", "Life Insurance (Non-Public Servants)"),
+    (r"\bprs\b|private retirement|deferred annuity", "PRS & Deferred Annuity"),
+    (r"socso|perkeso", "SOCSO"),
+    (r"vaccin|immunis|immuniz", "Serious Disease/Vaccination"),
+    (r"fertility|\bivf\b", "Fertility Treatment"),
+    (r"screening|check.?up|medical exam|health exam|mental health|psycholog|counsel", "Medical & Mental Health Exam"),
+    (r"learning disab|autism|adhd|speech therapy|occupational therapy", "Rehabilitation for Learning Disabilities"),
+    (r"upskill|self.?enhancement|certification|workshop|short course|online course|training", "Upskilling/Self-Enhancement Courses"),
+    (r"tuition|universit|college|degree|programme|course fee|education|school fee", "Education Fees in Malaysia"),
+    (r"child.?care|nursery|kindergarten|taska|tadika", "Childcare Fees"),
+    (r"breast.?pump|breastfeed", "Breastfeeding Equipment"),
+    (r"sspn", "SSPN Deposit"),
+    (r"ev charg|charging (?:station|equipment)|wallbox", "EV Charging Equipment"),
+    (r"wheelchair|hearing aid|prosthe|disab", "Equipment for Disabled"),
+    (r"sport|gym|fitness|racket|badminton|swim|yoga|marathon|bicycle", "Sports Activity Expenses"),
+    (r"book|magazine|newspaper|computer|laptop|smartphone|\bphone\b|tablet|internet|broadband|electronic|lifestyle",
+     "Lifestyle Purchases"),
+)
+
+LABELS = [label for _, label, _, _ in RELIEFS]
+RELIEF_INDEX = {label: i for i, label in enumerate(LABELS)}
+SECTION_OF = {label: section for section, label, _, _ in RELIEFS}
+
+
+def classify_items(names, categories):
+    """
+    Relief index (into RELIEFS) of each line item, or -1 for non-deductible
+    spend, matching every rule against all items at once.
+    """
+    text = (pd.Series(list(names), dtype=object).fillna("") + " "
+            + pd.Series(list(categories), dtype=object).fillna("")).str.lower()
+    indices = np.full(len(text), -1, dtype=np.int64)
+    for pattern, label in RELIEF_RULES:
+        unassigned = indices == -1
+        if not unassigned.any():
+            break
+        matched = unassigned & text.str.contains(pattern, regex=True).to_numpy()
+        indices[matched] = RELIEF_INDEX[label]
+    return indices
+
+
+def relief_section(name, category):
+    """Section of the relief a line item counts towards, or NON_DEDUCTIBLE"""
+    index = classify_items([name], [category])[0]
+    return NON_DEDUCTIBLE if index < 0 else RELIEFS[index][0]
@@ -0,0 +1,173 @@
+# relief_engine.py
+
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from receipt_manifest import DEFAULT_USER_ID
+from receipt_schema import parse_amount
+from receipt_store import receipt_store
+from relief_categories import GROUP_CAPS, RELIEF_INDEX, RELIEFS, SECTION_ICONS, classify_items
+
+logger = logging.getLogger(__name__)
+
+# Granted to every resident individual without any receipts
+AUTOMATIC_RELIEFS = {"Automatic Individual Relief": 9000}
+
+# Illustrative claims shown until the user has confirmed any receipts for the year
+SAMPLE_CLAIMS = {
+    "Automatic Individual Relief": 9000, "Medical Expenses For Parents": 4000, "Spouse/Alimony": 1000,
+    "Education Fees in Malaysia": 5000, "Upskilling/Self-Enhancement Courses": 1000,
+    "Serious Disease/Vaccination": 6000, "Medical & Mental Health Exam": 800,
+    "Lifestyle Purchases": 2500, "Sports Activity Expenses": 300,
+    "Breastfeeding Equipment": 1000, "Childcare Fees": 3000, "SSPN Deposit": 4000, "Child Relief": 2000,
+    "Life Insurance (Non-Public Servants)": 3000, "EPF (Statutory & Voluntary)": 4000,
+    "PRS & Deferred Annuity": 2500, "Education and Medical Insurance": 3000, "SOCSO": 250,
+}
+
+
+def claims_vector(amounts):
+    """Vector of claims in cents, one entry per relief, from {relief: RM}"""
+    vector = np.zeros(len(RELIEFS), dtype=np.int64)
+    for label, amount in amounts.items():
+        vector[RELIEF_INDEX[label]] += int(round(amount * 100))
+    return vector
+
+
+class ReliefEngine:
+    """
+    Applies per-relief caps and shared limits to a vector of claims (cents,
+    one entry per relief in RELIEFS) in a single vectorised pass. Within a
+    shared limit, reliefs are granted in table order until the limit runs out.
+    """
+
+    def __init__(self, reliefs=RELIEFS, group_caps=GROUP_CAPS):
+        self.table = pd.DataFrame(reliefs, columns=["section", "label", "cap", "group"])
+        self.caps = self.table["cap"].to_numpy(dtype=np.int64) * 100
+        # Reliefs without a shared limit form a group of their own
+        groups = self.table["group"].fillna(self.table["label"])
+        self.group_ids = pd.factorize(groups)[0]
+        self.group_caps = np.array(
+            [group_caps.get(group, cap) for group, cap in zip(groups, self.table["cap"])], dtype=np.int64
+        ) * 100
+        # Reliefs ordered by group (table order within each), and where each one's group starts in that order
+        self._order = np.argsort(self.group_ids, kind="stable")
+        sorted_ids = self.group_ids[self._order]
+        starts = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+        self._group_start = np.maximum.accumulate(np.where(starts, np.arange(len(sorted_ids)), 0))
+
+    def apply_caps(self, claims):
+        """Allowed relief in cents for each entry of claims"""
+        capped = np.minimum(claims, self.caps)
+        # Running total within each group of the reliefs granted before this one
+        grouped = capped[self._order]
+        running = np.cumsum(grouped)
+        before = running - grouped - (running - grouped)[self._group_start]
+        used_before = np.empty_like(before)
+        used_before[self._order] = before
+        return np.clip(self.group_caps - used_before, 0, capped)
+
+    def breakdown(self, claims):
+        """{section: [(relief, claimed RM, cap RM)]} in table order, as rendered on the Tax Deduction page"""
+        allowed = self.apply_caps(claims) / 100
+        sections = {}
+        for (section, label, cap, _), amount in zip(RELIEFS, allowed):
+            sections.setdefault(section, []).append((label, float(amount), cap))
+        return sections
+
+    def total(self, claims):
+        return float(self.apply_caps(claims).sum() / 100)
+
+
+class ReliefLedger:
+    """
+    Receipt spend per relief for each (user, year). A year is classified in one
+    pass over its line items the first time it is needed; after that each
+    confirmed receipt only adds (or replaces) its own contribution.
+    """
+
+    def __init__(self, store=receipt_store):
+        self.store = store
+        self._claims = {}
+        self._contributions = {}
+        self._lock = threading.Lock()
+
+    def _contribution(self, relief_indices, cents):
+        keep = (relief_indices >= 0) & (cents > 0)
+        return np.bincount(relief_indices[keep], weights=cents[keep], minlength=len(RELIEFS)).astype(np.int64)
+
+    def _load(self, user_id, year):
+        key = (user_id, year)
+        if key in self._claims:
+            return
+        rows = self.store.item_rows(user_id, year)
+        frame = pd.DataFrame([tuple(row) for row in rows], columns=["receipt_id", "name", "category", "cents"])
+        frame["relief"] = classify_items(frame["name"], frame["category"])
+        frame["cents"] = frame["cents"].fillna(0).astype(np.int64)
+        contributions = {
+            receipt_id: self._contribution(group["relief"].to_numpy(), group["cents"].to_numpy())
+            for receipt_id, group in frame.groupby("receipt_id")
+        }
+        self._contributions[key] = contributions
+        self._claims[key] = sum(contributions.values(), np.zeros(len(RELIEFS), dtype=np.int64))
+
+    def add_receipt(self, user_id, year, receipt_id, receipt_data):
+        """Fold one confirmed receipt into its year; re-adding a receipt replaces it"""
+        # The edit form splits names, prices and categories separately; pair them up as the store does
+        items = list(zip(receipt_data.get("Item name", []), receipt_data.get("Item price", []),
+                         receipt_data.get("Item category", [])))
+        relief_indices = classify_items([name for name, _, _ in items], [category for _, _, category in items])
+        amounts = (parse_amount(price) for _, price, _ in items)
+        cents = np.array([0 if amount is None else int((amount * 100).to_integral_value()) for amount in amounts],
+                         dtype=np.int64)
+        contribution = self._contribution(relief_indices, cents)
+        with self._lock:
+            key = (user_id, year)
+            if key not in self._claims:
+                # Not loaded yet: the store already holds the receipt and the first read picks it up
+                return
+            previous = self._contributions[key].get(receipt_id)
+            if previous is not None:
+                self._claims[key] -= previous
+            self._contributions[key][receipt_id] = contribution
+            self._claims[key] += contribution
+
+    def claims(self, user_id, year):
+        """Receipt-backed claims in cents per relief, and how many receipts back them"""
+        with self._lock:
+            self._load(user_id, year)
+            return self._claims[(user_id, year)].copy(), len(self._contributions[(user_id, year)])
+
+
+relief_engine = ReliefEngine()
+relief_ledger = ReliefLedger()
+SAMPLE_VECTOR = claims_vector(SAMPLE_CLAIMS)
+AUTOMATIC_VECTOR = claims_vector(AUTOMATIC_RELIEFS)
+
+
+def relief_claims(user_id=DEFAULT_USER_ID, year=None):
+    """
+    Claims in cents per relief: the user's confirmed receipts plus automatic
+    reliefs, or the sample claims until any receipts are confirmed
+    """
+    year = year or datetime.now().year
+    try:
+        receipt_claims, receipts = relief_ledger.claims(user_id, year)
+    except Exception as e:
+        logger.error("Failed to load relief ledger: %s", e)
+        receipts = 0
+    if not receipts:
+        return SAMPLE_VECTOR.copy()
+    return receipt_claims + AUTOMATIC_VECTOR
+
+
+def relief_breakdown(user_id=DEFAULT_USER_ID, year=None):
+    """Claimed versus cap for every relief in the tax year"""
+    return relief_engine.breakdown(relief_claims(user_id, year))
+
+
+def section_title(section):
+    return f"{SECTION_ICONS.get(section, '')} {section}".strip()
@@ -0,0 +1,207 @@
+# relief_rules.py
+
+import math
+import re
+from collections import Counter, namedtuple
+
+from relief_categories import GROUP_CAPS, RELIEFS
+
+ReliefRule = namedtuple("ReliefRule", ["section", "label", "cap", "group", "eligibility", "documents", "keywords"])
+
+# Who can claim each relief, what to keep as proof, and other words people use for it
+RELIEF_DETAILS = {
+    "Automatic Individual Relief": (
+        "Every resident individual gets it automatically; nothing needs to be claimed.",
+        "None.",
+        "individual personal self basic automatic"),
+    "Medical Expenses For Parents": (
+        "Medical treatment, special needs and carer expenses for your parents, including complete medical examinations.",
+        "Receipts from the clinic, hospital or carer, and your parents' IC copies.",
+        "parent parents mother father medical treatment carer nursing home"),
+    "Spouse/Alimony": (
+        "A spouse with no income (or who elects joint assessment), or alimony paid to a former wife.",
+        "Marriage certificate, or the court order or formal alimony agreement.",
+        "spouse wife husband alimony joint assessment"),
+    "Education Fees in Malaysia": (
+        "Your own fees at a recognised Malaysian institution: law, accounting, Islamic finance, technical, "
+        "vocational, industrial, scientific or technology courses up to first degree, or any master's or doctorate.",
+        "Fee receipts and the offer or enrolment letter.",
+        "education tuition university college degree masters phd doctorate course fees self"),
+    "Upskilling/Self-Enhancement Courses": (
+        "Upskilling or self-enhancement courses recognised by the Department of Skills Development; "
+        "counts towards the education fees limit.",
+        "Fee receipts and the course certificate.",
+        "upskilling self enhancement skills course training certificate"),
+    "Serious Disease/Vaccination": (
+        "Treatment of serious diseases for you, your spouse or child, and vaccinations.",
+        "Receipts and a medical report or certificate from the doctor.",
+        "serious disease illness cancer vaccination vaccine treatment"),
+    "Fertility Treatment": (
+        "Fertility treatment such as IVF for you or your spouse.",
+        "Receipts and a medical report from the fertility clinic.",
+        "fertility ivf treatment infertility"),
+    "Medical & Mental Health Exam": (
+        "Complete medical examinations, health screening and mental health examinations or consultations.",
+        "Receipts from the clinic, hospital or psychologist.",
+        "medical checkup check health screening exam mental psychologist"),
+    "Rehabilitation for Learning Disabilities": (
+        "Assessment, intervention and rehabilitation for a child aged 18 or below diagnosed with a learning disability.",
+        "The diagnosis and receipts from the treatment provider.",
+        "learning disability autism adhd rehabilitation therapy intervention"),
+    "Lifestyle Purchases": (
+        "Books, magazines and newspapers, a personal computer, smartphone or tablet, internet subscriptions "
+        "and skill improvement courses for you, your spouse or child.",
+        "Receipts or invoices in your name.",
+        "lifestyle book books magazine newspaper computer laptop smartphone phone tablet internet gadget"),
+    "Sports Activity Expenses": (
+        "Sports equipment, entry or rental fees for sports facilities, competition registration, gym membership "
+        "and sports training.",
+        "Receipts or invoices in your name.",
+        "sports sport gym fitness equipment membership training competition"),
+    "EV Charging Equipment": (
+        "Buying, installing or renting charging equipment for your own electric vehicle.",
+        "Receipts and the installation invoice.",
+        "ev electric vehicle charging charger wallbox"),
+    "Breastfeeding Equipment": (
+        "Breastfeeding equipment for a mother with a child aged 2 or below, once every two years.",
+        "Receipts and the child's birth certificate.",
+        "breastfeeding breast pump nursing mother"),
+    "Childcare Fees": (
+        "Fees for a child aged 6 or below at a registered childcare centre or kindergarten.",
+        "Fee receipts and the centre's registration details.",
+        "childcare child care kindergarten nursery taska tadika preschool"),
+    "SSPN Deposit": (
+        "Net deposits (deposits less withdrawals) into the National Education Savings Scheme for your children.",
+        "The SSPN annual statement.",
+        "sspn national education savings scheme ptptn deposit"),
+    "Child Relief": (
+        "Each unmarried child under 18.",
+        "The child's birth certificate.",
+        "child children kid kids son daughter under 18 dependent"),
+    "Child 18+ in Full-Time Education": (
+        "Each unmarried child aged 18 or above in full-time A-level, certificate, matriculation or preparatory courses.",
+        "The child's enrolment letter.",
+        "child son daughter 18 above full time education matriculation a level foundation"),
+    "Child 18+ in Tertiary Education": (
+        "Each unmarried child aged 18 or above studying for a diploma or higher in Malaysia, "
+        "or a degree or higher abroad.",
+        "The child's enrolment letter or student card.",
+        "child son daughter 18 above tertiary diploma degree university abroad"),
+    "Life Insurance (Non-Public Servants)": (
+        "Life insurance or family takaful premiums for you or your spouse; "
+        "shares its limit with EPF contributions.",
+        "The premium statement from the insurer.",
+        "life insurance takaful premium policy"),
+    "EPF (Statutory & Voluntary)": (
+        "Statutory and voluntary EPF contributions; shares its limit with life insurance.",
+        "The EPF annual statement or payslips.",
+        "epf kwsp provident fund contribution retirement"),
+    "PRS & Deferred Annuity": (
+        "Contributions to a Private Retirement Scheme and deferred annuity premiums.",
+        "The PRS provider's or insurer's statement.",
+        "prs private retirement scheme deferred annuity"),
+    "Education and Medical Insurance": (
+        "Education or medical insurance premiums for you, your spouse or child.",
+        "The premium statement from the insurer.",
+        "education medical insurance takaful premium"),
+    "SOCSO": (
+        "Employee contributions to SOCSO and the Employment Insurance System.",
+        "Payslips or the SOCSO statement.",
+        "socso perkeso eis employment insurance contribution"),
+    "Equipment for Disabled": (
+        "Supporting equipment for a disabled you, spouse, child or parent.",
+        "Receipts and the OKU card issued by the Department of Social Welfare.",
+        "disabled disability equipment wheelchair hearing aid oku"),
+    "Disabled Individual": (
+        "You are registered as disabled with the Department of Social Welfare.",
+        "Your OKU card.",
+        "disabled disability oku individual self"),
+    "Disabled Spouse": (
+        "Your spouse is registered as disabled with the Department of Social Welfare.",
+        "Your spouse's OKU card.",
+        "disabled disability oku spouse wife husband"),
+    "Disabled Child": (
+        "Each unmarried child registered as disabled with the Department of Social Welfare.",
+        "The child's OKU card.",
+        "disabled disability oku child"),
+    "Disabled Child 18+ in Education/Training": (
+        "An additional relief for a disabled child aged 18 or above in higher education or skills training.",
+        "The child's OKU card and enrolment letter.",
+        "disabled disability oku child 18 above education training"),
+}
+
+RELIEF_RULES = tuple(
+    ReliefRule(section, label, cap, group, *RELIEF_DETAILS[label])
+    for section, label, cap, group in RELIEFS
+)
+
+STOP_WORDS = frozenset(
+    "a an and any are as at be by can claim claims do does for from how i in is it its my of on or "
+    "the to what when which who will with you your me much under relief reliefs tax need document proof".split()
+)
+
+
+def tokenize(text):
+    """Lowercase words without stop words, with a plural 's' dropped"""
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    return [word[:-1] if len(word) > 4 and word.endswith("s") else word for word in words if word not in STOP_WORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a handful of short documents"""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tokenize(document)) for document in documents]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.lengths)
+        frequencies = Counter(term for doc in self.docs for term in doc)
+        self.idf = {
+            term: math.log(1 + (len(self.docs) - count + 0.5) / (count + 0.5))
+            for term, count in frequencies.items()
+        }
+
+    def search(self, query):
+        """(score, document index) of every matching document, best first"""
+        terms = [term for term in tokenize(query) if term in self.idf]
+        scores = []
+        for i, (doc, length) in enumerate(zip(self.docs, self.lengths)):
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term, 0)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (
+                        tf + self.k1 * (1 - self.b + self.b * length / self.avg_length))
+            if score:
+                scores.append((score, i))
+        return sorted(scores, reverse=True)
+
+
+# Only the relief's name (counted double), section and keywords are searched: a question has to name
+# the relief, and words that merely appear in its eligibility text ("income", "pay") do not count
+relief_index = BM25Index([
+    f"{rule.label} {rule.label} {rule.section} {rule.keywords}" for rule in RELIEF_RULES
+])
+
+# Leading match must score at least this and beat the runner-up by this ratio to be answered locally
+MIN_SCORE = 3.0
+MIN_MARGIN = 2.0
+
+
+def find_relief(question):
+    """The relief rule a question is clearly about, or None when no or several reliefs match"""
+    results = relief_index.search(question)
+    if not results or results[0][0] < MIN_SCORE:
+        return None
+    if len(results) > 1 and results[0][0] < MIN_MARGIN * results[1][0]:
+        return None
+    return RELIEF_RULES[results[0][1]]
+
+
+def shared_limit(rule):
+    """(combined cap, other reliefs) of the limit a relief shares, or None"""
+    if rule.group is None:
+        return None
+    others = [other.label for other in RELIEF_RULES if other.group == rule.group and other.label != rule.label]
+    return GROUP_CAPS[rule.group], others
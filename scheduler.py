@@ -0,0 +1,174 @@
+# scheduler.py
+
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import gradio as gr
+
+from log_utils import get_logger, log_event
+
+logger = get_logger(__name__)
+
+# Waits kept per lane for the p50/p95 in stats()
+WAIT_SAMPLES = 512
+
+
+def _lane_setting(lane, setting, default):
+    return float(os.getenv(f"LANE_{lane.upper()}_{setting}", default))
+
+
+class Lane:
+    """
+    A class of UI events with its own worker slots. Events beyond the slots
+    wait in the lane, and once max_waiting are waiting (or one has waited
+    max_wait seconds) new events are turned away at once with a busy message,
+    so a burst in one lane cannot hold up the others.
+    """
+
+    def __init__(self, name, workers, max_waiting, max_wait, busy_message):
+        self.name = name
+        self.workers = int(workers)
+        self.max_waiting = int(max_waiting)
+        self.max_wait = max_wait
+        self.busy_message = busy_message
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self.running = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _reject(self, reason):
+        log_event(logger, "scheduler.reject", lane=self.name, reason=reason,
+                  running=self.running, waiting=self.waiting)
+        raise gr.Error(self.busy_message, duration=5)
+
+    def acquire(self):
+        started = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    full = True
+                else:
+                    self.waiting += 1
+                    self.peak_waiting = max(self.peak_waiting, self.waiting)
+                    full = False
+            if full:
+                self._reject("queue_full")
+            acquired = self._slots.acquire(timeout=self.max_wait)
+            with self._lock:
+                self.waiting -= 1
+                if not acquired:
+                    self.timed_out += 1
+            if not acquired:
+                self._reject("wait_timeout")
+        with self._lock:
+            self._waits.append(time.monotonic() - started)
+            self.running += 1
+
+    def release(self):
+        with self._lock:
+            self.running -= 1
+            self.completed += 1
+        self._slots.release()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """Queue depth now and at peak, outcomes, and recent wait times in ms"""
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = {
+                "workers": self.workers,
+                "running": self.running,
+                "waiting": self.waiting,
+                "peak_waiting": self.peak_waiting,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+        stats["wait_p50_ms"] = round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0
+        stats["wait_p95_ms"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0
+        return stats
+
+
+# Instant UI updates (row visibility, totals, checklist, table selection) skip the queue altogether
+INTERACTIVE = "interactive"
+
+# Worker slots, waiting events and seconds an event may wait, each overridable per lane,
+# e.g. LANE_VLM_WORKERS=2 LANE_VLM_QUEUE=4 LANE_VLM_MAX_WAIT=30
+LANES = {
+    # Local store reads and writes: receipt confirmation, original images, scorecard
+    "io": Lane("io", _lane_setting("io", "WORKERS", 8), _lane_setting("io", "QUEUE", 32),
+               _lane_setting("io", "MAX_WAIT", 10),
+               "The server is busy saving receipts. Please try again in a moment."),
+    # Qwen-Max calls: tax summaries and chat
+    "llm": Lane("llm", _lane_setting("llm", "WORKERS", 4), _lane_setting("llm", "QUEUE", 16),
+                _lane_setting("llm", "MAX_WAIT", 30),
+                "The tax assistant is busy answering other questions. Please try again in a moment."),
+    # Qwen-VL receipt scans, single and batch
+    "vlm": Lane("vlm", _lane_setting("vlm", "WORKERS", 4), _lane_setting("vlm", "QUEUE", 8),
+                _lane_setting("vlm", "MAX_WAIT", 60),
+                "Receipt scanning is busy with other uploads. Please try again in a moment."),
+}
+
+# Gradio worker threads beyond the lanes' running and waiting events, for everything else
+THREAD_HEADROOM = int(os.getenv("SCHEDULER_THREAD_HEADROOM", "40"))
+# Events Gradio itself queues (those outside a lane) before turning new ones away
+APP_QUEUE_MAX_SIZE = int(os.getenv("APP_QUEUE_MAX_SIZE", "64"))
+
+
+def scheduled(lane_name):
+    """Run the decorated handler (plain or generator) in a slot of the named lane"""
+    lane = LANES[lane_name]
+
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with lane.slot():
+                    yield from fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with lane.slot():
+                    return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def lane_options(lane_name):
+    """
+    Event listener arguments for a lane. Lane events are admitted by Gradio
+    straight away and limited by their lane instead of Gradio's single
+    default worker; interactive events bypass the queue.
+    """
+    if lane_name == INTERACTIVE:
+        return {"queue": False}
+    return {"concurrency_id": lane_name, "concurrency_limit": None}
+
+
+def thread_budget():
+    """Gradio worker threads enough for every lane to fill its slots and queue"""
+    return THREAD_HEADROOM + sum(lane.workers + lane.max_waiting for lane in LANES.values())
+
+
+def scheduler_stats():
+    """stats() of every lane by name"""
+    return {name: lane.stats() for name, lane in LANES.items()}
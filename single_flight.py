@@ -0,0 +1,79 @@
+# single_flight.py
+
+import threading
+from concurrent.futures import Future
+
+# Every SingleFlight by name, for flight_stats()
+_flights = {}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the
+    call and every caller arriving while it is in flight waits for and shares
+    its result (or exception). Nothing is kept once the call returns, so this
+    is not a cache.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        _flights[name] = self
+
+    def begin(self, key):
+        """
+        (future, leader) for key. The leader must run the call and hand the
+        outcome to finish(); other callers wait on the future.
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._flights.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs), or wait for the identical call already in flight"""
+        future, leader = self.begin(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._flights
+
+    def stats(self):
+        """Calls made, upstream calls saved by sharing, and calls in flight now"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "saved": self.shared,
+                "in_flight": len(self._flights),
+                "saved_rate": self.shared / self.calls if self.calls else 0.0,
+            }
+
+
+def flight_stats():
+    """stats() of every SingleFlight by name"""
+    return {name: flight.stats() for name, flight in _flights.items()}
@@ -0,0 +1,83 @@
+# tax_calculator.py
+
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+import numpy as np
+
+from relief_engine import relief_engine
+
+# Resident individual rates from YA2023: (upper bound of the band in RM, rate in %)
+RESIDENT_BANDS = (
+    (5000, 0),
+    (20000, 1),
+    (35000, 3),
+    (50000, 6),
+    (70000, 11),
+    (100000, 19),
+    (400000, 25),
+    (600000, 26),
+    (2000000, 28),
+    (None, 30),
+)
+# Individual rebate for a chargeable income of RM35,000 or less
+REBATE_LIMIT = 35000
+INDIVIDUAL_REBATE = 400
+
+# Annual income used until the profile has any monthly income recorded
+SAMPLE_ANNUAL_INCOME = 102350
+
+TaxResult = namedtuple("TaxResult", ["income", "reliefs", "chargeable_income", "tax", "rebate", "payable"])
+
+
+def _rm(cents):
+    return (Decimal(cents) / 100).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def _to_cents(amount):
+    return int((Decimal(str(amount or 0)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def band_tax_cents(chargeable_cents):
+    """Tax in cents on a chargeable income in cents, before rebates"""
+    tax, lower = 0, 0
+    for upper, rate in RESIDENT_BANDS:
+        upper_cents = None if upper is None else upper * 100
+        if chargeable_cents <= lower:
+            break
+        portion = chargeable_cents - lower if upper_cents is None else min(chargeable_cents, upper_cents) - lower
+        tax += portion * rate
+        lower = upper_cents
+    # tax is in hundredths of a cent here
+    return (tax + 50) // 100
+
+
+@lru_cache(maxsize=1024)
+def _compute(income_cents, claims_snapshot):
+    claims = np.frombuffer(claims_snapshot, dtype=np.int64)
+    reliefs_cents = int(relief_engine.apply_caps(claims).sum())
+    chargeable_cents = max(income_cents - reliefs_cents, 0)
+    tax_cents = band_tax_cents(chargeable_cents)
+    rebate_cents = min(tax_cents, INDIVIDUAL_REBATE * 100) if chargeable_cents <= REBATE_LIMIT * 100 else 0
+    return TaxResult(_rm(income_cents), _rm(reliefs_cents), _rm(chargeable_cents),
+                     _rm(tax_cents), _rm(rebate_cents), _rm(tax_cents - rebate_cents))
+
+
+def compute_tax(annual_income, claims):
+    """
+    Tax payable for a year's income (RM) and per-relief claims (cents, see
+    relief_engine). Results are memoised on a snapshot of both inputs, so an
+    unchanged profile and receipt set costs a hash lookup.
+    """
+    return _compute(_to_cents(annual_income), np.ascontiguousarray(claims, dtype=np.int64).tobytes())
+
+
+def chargeable_income_tax(chargeable_income):
+    """Tax payable on a chargeable income in RM, after the individual rebate"""
+    chargeable_cents = _to_cents(chargeable_income)
+    tax_cents = band_tax_cents(chargeable_cents)
+    if chargeable_cents <= REBATE_LIMIT * 100:
+        tax_cents -= min(tax_cents, INDIVIDUAL_REBATE * 100)
+    return _rm(tax_cents)
+
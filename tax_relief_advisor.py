@@ -1,24 +1,51 @@
+import logging
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
-from dashscope import Application
-import dashscope
 from datetime import datetime
+from answer_cache import answer_cache
+from dashscope_client import call_application, stream_application
+from receipt_manifest import DEFAULT_USER_ID
+from relief_engine import relief_breakdown
+from relief_rules import find_relief, shared_limit
+from single_flight import SingleFlight
+from ttl_cache import TTLCache, snapshot_key
 
-# Configure DashScope
-dashscope.base_http_api_url = 'https://dashscope-intl.aliyuncs.com/api/v1'
+logger = logging.getLogger(__name__)
 
-def get_tax_summary():
-    """Get a brief summary of tax relief analysis"""
-    expenses = {
-        "Automatic individual relief": 9000,
-        "Medical expenses for parents": 8000,
-        "Education fees in Malaysia": 5000
-    }
+# ModelStudio RAG application backed by the LHDN knowledge base
+APP_ID = 'f15e6f2c3b56437bac6d0afe9b018f02'
+RAG_OPTIONS = {
+    "knowledge_base_ids": ["r94ym9j3g7"],
+    "top_k": 5,
+    "similarity_threshold": 0.7,
+    "return_source": True
+}
 
-    prompt = f"""Based on these Malaysian tax expenses for year {datetime.now().year}:
-1. Automatic individual relief: RM {expenses['Automatic individual relief']}
-2. Medical expenses for parents: RM {expenses['Medical expenses for parents']}
-3. Education fees in Malaysia: RM {expenses['Education fees in Malaysia']}
+# Bump when the summary prompt changes so cached summaries are regenerated
+SUMMARY_PROMPT_VERSION = "summary-v2"
+summary_cache = TTLCache(
+    max_entries=int(os.getenv('TAX_SUMMARY_CACHE_ENTRIES', '256')),
+    ttl=float(os.getenv('TAX_SUMMARY_CACHE_TTL', str(24 * 3600))),
+)
+# One background regeneration at a time; the model call dominates anyway
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tax-summary")
+# Clicks and background refreshes for the same snapshot share one model call
+summary_flight = SingleFlight("tax_summary")
+
+def expense_snapshot(user_id=DEFAULT_USER_ID, year=None):
+    """Claimed relief per category (RM) the summary is based on, in relief table order"""
+    return [
+        (label, claimed)
+        for bars in relief_breakdown(user_id, year).values()
+        for label, claimed, _ in bars if claimed
+    ]
+
+def summary_prompt(expenses, year):
+    lines = "\n".join(f"{i}. {label}: RM {claimed:,.2f}" for i, (label, claimed) in enumerate(expenses, 1))
+    return f"""Based on these Malaysian tax expenses for year {year}:
+{lines}
 
 Provide a BRIEF summary (max 5 bullet points) of key tax relief insights, focusing on:
 - Current utilization status
@@ -27,21 +54,26 @@ Provide a BRIEF summary (max 5 bullet points) of key tax relief insights, focusi
 - Any unused relief categories that could be beneficial
 - Next steps"""
 
+def _summary_request(user_id, year):
+    year = year or datetime.now().year
+    expenses = expense_snapshot(user_id, year)
+    return snapshot_key(expenses, year, SUMMARY_PROMPT_VERSION), summary_prompt(expenses, year)
+
+def _generate_summary(key, prompt):
+    # A call that finished just before this one started has already cached the summary
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary, None
     try:
-        response = Application.call(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            app_id='f15e6f2c3b56437bac6d0afe9b018f02',
-            prompt=prompt,
-            rag_options={
-                "knowledge_base_ids": ["r94ym9j3g7"],
-                "top_k": 5,
-                "similarity_threshold": 0.7,
-                "return_source": True
-            }
+        response = call_application(
+            APP_ID,
+            prompt,
+            rag_options=RAG_OPTIONS
         )
 
         if response.status_code == HTTPStatus.OK:
-            return response.output.text, None
+            summary_cache.put(key, response.output["text"])
+            return response.output["text"], None
         else:
             error_msg = f"Error: API call failed (Status: {response.status_code}, Message: {response.message})"
             return None, error_msg
@@ -49,46 +81,104 @@ Provide a BRIEF summary (max 5 bullet points) of key tax relief insights, focusi
     except Exception as e:
         return None, str(e)
 
-def chat_with_context(user_input, session_id=None):
-    """Chat with the AI while maintaining tax context"""
-    try:
-        # If no session_id, start a new conversation with context
-        if not session_id:
-            context = """Current Malaysian tax expenses context:
+def get_tax_summary(user_id=DEFAULT_USER_ID, year=None):
+    """Get a brief summary of tax relief analysis, cached per expense snapshot"""
+    key, prompt = _summary_request(user_id, year)
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary, None
+    return summary_flight.do(key, _generate_summary, key, prompt)
+
+def refresh_tax_summary(user_id=DEFAULT_USER_ID, year=None):
+    """Regenerate the summary in the background if the expense snapshot has no cached summary"""
+    key, prompt = _summary_request(user_id, year)
+    if key in summary_cache or summary_flight.in_flight(key):
+        return None
+
+    def refresh():
+        summary, error = summary_flight.do(key, _generate_summary, key, prompt)
+        if error:
+            logger.warning("Background tax summary failed: %s", error)
+        return summary, error
+
+    return summary_executor.submit(refresh)
+
+CHAT_CONTEXT = """Current Malaysian tax expenses context:
 - Automatic individual relief: RM 9,000
 - Medical expenses for parents: RM 8,000
 - Education fees in Malaysia: RM 5,000
 
 Please provide tax-related advice based on this context."""
-            
-            response = Application.call(
-                api_key=os.getenv("DASHSCOPE_API_KEY"),
-                app_id='f15e6f2c3b56437bac6d0afe9b018f02',
-                prompt=f"{context}\n\nUser question: {user_input}",
-                rag_options={
-                    "knowledge_base_ids": ["r94ym9j3g7"],
-                    "top_k": 5,
-                    "similarity_threshold": 0.7,
-                    "return_source": True
-                }
-            )
-        else:
-            # Continue existing conversation
-            response = Application.call(
-                api_key=os.getenv("DASHSCOPE_API_KEY"),
-                app_id='f15e6f2c3b56437bac6d0afe9b018f02',
-                prompt=user_input,
-                session_id=session_id,
-                rag_options={
-                    "knowledge_base_ids": ["r94ym9j3g7"],
-                    "top_k": 5,
-                    "similarity_threshold": 0.7,
-                    "return_source": True
-                }
-            )
+
+# First-turn answers depend only on the knowledge base and the context above
+CHAT_CACHE_NAMESPACE = (tuple(RAG_OPTIONS["knowledge_base_ids"]), snapshot_key(APP_ID, CHAT_CONTEXT))
+
+def _chat_prompt(user_input, session_id):
+    # A new conversation starts with the tax context; an existing one already has it
+    return user_input if session_id else f"{CHAT_CONTEXT}\n\nUser question: {user_input}"
+
+# Lookups the relief rules answer without the LLM
+CAP_QUESTION = re.compile(r"\b(caps?|capped|limits?|max|maximum|how much|up to|ceiling)\b")
+ELIGIBILITY_QUESTION = re.compile(r"\b(eligib\w*|qualif\w*|who can|entitled|deductible|claimable|covered)\b")
+DOCUMENT_QUESTION = re.compile(r"\b(documents?|proof|receipts?|evidence|supporting)\b")
+# Advice and reasoning go to the LLM even when they name a relief
+OPEN_ENDED_QUESTION = re.compile(r"\b(should|recommend\w*|best|optimi[sz]\w*|strateg\w*|plan\w*|why|compare|better|advice|explain)\b")
+# Tax payable, rates and savings depend on the user's income and go to the LLM
+TAX_PAYABLE_QUESTION = re.compile(
+    r"\b(how much tax|tax (do|will|would|should) i|(pay|owe)\w* (in )?tax|taxable|income tax|chargeable"
+    r"|tax (payable|rates?|brackets?|bands?)|rates?|brackets?|rebates?|refunds?|save|saving)\b"
+)
+
+def answer_locally(question):
+    """Answer a cap, eligibility or documents lookup from the relief rules, or None to ask the LLM"""
+    text = (question or "").lower()
+    asks_cap, asks_eligibility, asks_documents = (
+        bool(pattern.search(text)) for pattern in (CAP_QUESTION, ELIGIBILITY_QUESTION, DOCUMENT_QUESTION)
+    )
+    if not (asks_cap or asks_eligibility or asks_documents):
+        return None
+    if OPEN_ENDED_QUESTION.search(text) or TAX_PAYABLE_QUESTION.search(text):
+        return None
+    rule = find_relief(question)
+    if rule is None:
+        return None
+
+    lines = [f"**{rule.label}** ({rule.section})"]
+    if asks_cap:
+        lines.append(f"- Capped at RM {rule.cap:,} per year of assessment.")
+        shared = shared_limit(rule)
+        if shared:
+            group_cap, others = shared
+            lines.append(f"- Shares a combined RM {group_cap:,} limit with {', '.join(others)}.")
+    if asks_eligibility:
+        lines.append(f"- Who can claim: {rule.eligibility}")
+    if asks_documents:
+        lines.append(f"- Documents to keep: {rule.documents}")
+    logger.debug("Answered %r locally from %s", question, rule.label)
+    return "\n".join(lines)
+
+def chat_with_context(user_input, session_id=None):
+    """Chat with the AI while maintaining tax context"""
+    local = answer_locally(user_input)
+    if local:
+        return local, session_id, None
+    if not session_id:
+        # A cached answer starts no upstream conversation, so the next question is a first turn again
+        cached = answer_cache.get(user_input, CHAT_CACHE_NAMESPACE)
+        if cached:
+            return cached, None, None
+    try:
+        response = call_application(
+            APP_ID,
+            _chat_prompt(user_input, session_id),
+            session_id=session_id,
+            rag_options=RAG_OPTIONS
+        )
 
         if response.status_code == HTTPStatus.OK:
-            return response.output.text, response.output.session_id, None
+            if not session_id and response.output["text"]:
+                answer_cache.put(user_input, response.output["text"], CHAT_CACHE_NAMESPACE)
+            return response.output["text"], response.output.get("session_id"), None
         else:
             error_msg = f"Error: API call failed (Status: {response.status_code}, Message: {response.message})"
             return None, None, error_msg
@@ -96,6 +186,46 @@ Please provide tax-related advice based on this context."""
     except Exception as e:
         return None, None, str(e)
 
+def stream_chat_with_context(user_input, session_id=None):
+    """
+    Chat like chat_with_context, streaming the answer as it is generated.
+    Yields (answer so far, session_id, error); closing the generator cancels the call.
+    """
+    local = answer_locally(user_input)
+    if local:
+        yield local, session_id, None
+        return
+    if not session_id:
+        cached = answer_cache.get(user_input, CHAT_CACHE_NAMESPACE)
+        if cached:
+            yield cached, None, None
+            return
+    stream = stream_application(
+        APP_ID,
+        _chat_prompt(user_input, session_id),
+        session_id=session_id,
+        rag_options=RAG_OPTIONS
+    )
+    text, new_session_id = "", session_id
+    try:
+        for event in stream:
+            if event.status_code != HTTPStatus.OK:
+                yield text, None, f"Error: API call failed (Status: {event.status_code}, Message: {event.message})"
+                return
+            new_session_id = event.output.get("session_id") or new_session_id
+            delta = event.output.get("text") or ""
+            if delta:
+                text += delta
+                yield text, new_session_id, None
+        # An empty answer would be served to every similar question
+        if not session_id and text:
+            answer_cache.put(user_input, text, CHAT_CACHE_NAMESPACE)
+        yield text, new_session_id, None
+    except Exception as e:
+        yield text, None, str(e)
+    finally:
+        stream.close()
+
 if __name__ == "__main__":
     # Test summary
     summary, error = get_tax_summary()
@@ -0,0 +1,9 @@
+# tests/conftest.py
+
+import os
+import tempfile
+
+# The receipt store opens its database on import; keep it away from data/
+os.environ.setdefault("RECEIPT_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="taxy-tests-"), "receipts.db"))
+# Likewise the duplicate index journal
+os.environ.setdefault("RECEIPT_DUPLICATE_INDEX", os.path.join(tempfile.mkdtemp(prefix="taxy-tests-"), "duplicates.jsonl"))
@@ -0,0 +1,35 @@
+# tests/test_tax_calculator.py
+
+from decimal import Decimal
+
+import pytest
+
+from tax_calculator import chargeable_income_tax
+
+# (chargeable income, tax payable) at and around every band boundary
+RATE_BAND_CASES = [
+    (0, "0.00"),
+    (5000, "0.00"),
+    (5001, "0.00"),
+    (20000, "0.00"),
+    (35000, "200.00"),
+    (35001, "600.06"),
+    (50000, "1500.00"),
+    (50001, "1500.11"),
+    (70000, "3700.00"),
+    (70001, "3700.19"),
+    (100000, "9400.00"),
+    (100001, "9400.25"),
+    (400000, "84400.00"),
+    (400001, "84400.26"),
+    (600000, "136400.00"),
+    (600001, "136400.28"),
+    (2000000, "528400.00"),
+    (2000001, "528400.30"),
+    (2500000, "678400.00"),
+]
+
+
+@pytest.mark.parametrize("chargeable, expected", RATE_BAND_CASES, ids=[f"RM{c}" for c, _ in RATE_BAND_CASES])
+def test_tax_payable_at_band_edges(chargeable, expected):
+    assert chargeable_income_tax(chargeable) == Decimal(expected)
@@ -0,0 +1,42 @@
+# tests/test_upload_receipt.py
+
+import random
+
+from PIL import Image
+
+from duplicate_index import check_and_add, image_hash_file
+from upload_spool import UploadSpool
+from UploadReceipt import DEFAULT_USER_ID, find_scanned_duplicate, release_failed_upload
+
+RECEIPT = {"Merchant name": "Kedai Buku Ilmu", "Date of purchase": "2024-03-14", "Total amount spent": "89.90"}
+
+
+def receipt_image(path):
+    """A noisy image, detailed enough to be hashed"""
+    rng = random.Random(7)
+    image = Image.new("L", (64, 64))
+    image.putdata([rng.randrange(256) for _ in range(64 * 64)])
+    image.save(path)
+    return str(path)
+
+
+def test_rescan_after_spool_gives_up(tmp_path):
+    path = receipt_image(tmp_path / "receipt.png")
+    receipt_id = check_and_add(DEFAULT_USER_ID, "receipt-1", image_hash_file(path), dict(RECEIPT))
+
+    def unreachable_oss(*args, **kwargs):
+        raise ConnectionError("OSS unreachable")
+
+    spool = UploadSpool(unreachable_oss, directory=str(tmp_path / "spool"), max_attempts=1,
+                        on_give_up=release_failed_upload)
+    try:
+        spool.enqueue(path, dict(RECEIPT), DEFAULT_USER_ID, receipt_id)
+        assert spool.flush(timeout=10)
+    finally:
+        spool.stop()
+    assert spool.stats["failed"] == 1
+
+    # Scanning it again is not stopped as "already stored", and confirming it retries the same receipt
+    assert find_scanned_duplicate(path) is None
+    assert check_and_add(DEFAULT_USER_ID, "receipt-2", image_hash_file(path), dict(RECEIPT)) == receipt_id
+    assert find_scanned_duplicate(path) is not None
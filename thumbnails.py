@@ -0,0 +1,81 @@
+# thumbnails.py
+
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+
+from oss_store import get_bucket
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = os.getenv('RECEIPT_THUMBNAIL_DIR', os.path.join('data', 'thumbnails'))
+# Gallery tiles are 150px tall; twice that keeps them sharp on high-DPI screens
+THUMBNAIL_MAX_EDGE = int(os.getenv('RECEIPT_THUMBNAIL_MAX_EDGE', '320'))
+THUMBNAIL_QUALITY = int(os.getenv('RECEIPT_THUMBNAIL_QUALITY', '70'))
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def thumbnail_path(key):
+    """Cache path of the thumbnail for an object key (or a local image path)"""
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(THUMBNAIL_DIR, digest[:2], f"{digest}.{THUMBNAIL_FORMAT.lower()}")
+
+
+def make_thumbnail(key, source):
+    """Render and cache the thumbnail for key from a file path or file object"""
+    with Image.open(source) as image:
+        # Let the JPEG decoder skip most of the detail
+        image.draft("RGB", (THUMBNAIL_MAX_EDGE, THUMBNAIL_MAX_EDGE))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P", "PA"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.thumbnail((THUMBNAIL_MAX_EDGE, THUMBNAIL_MAX_EDGE), Image.LANCZOS)
+
+        path = thumbnail_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        image.save(tmp_path, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_thumbnail(key, source_path=None):
+    """
+    Cached thumbnail path for key, generating it on a miss from source_path
+    or else from the original in OSS. Returns None if no original is found.
+    """
+    path = thumbnail_path(key)
+    if os.path.exists(path):
+        return path
+    try:
+        if source_path and os.path.exists(source_path):
+            return make_thumbnail(key, source_path)
+        obj = get_bucket().get_object(key)
+        try:
+            return make_thumbnail(key, BytesIO(obj.read()))
+        finally:
+            obj.close()
+    except Exception as e:
+        logger.warning("No thumbnail for %s: %s", key, e)
+        return None
+
+
+def load_original(key, source_path=None):
+    """Full-resolution image for key: the local copy if present, else fetched from OSS"""
+    if source_path and os.path.exists(source_path):
+        return source_path
+    obj = get_bucket().get_object(key)
+    try:
+        image = Image.open(BytesIO(obj.read()))
+        image.load()
+        return image
+    finally:
+        obj.close()
@@ -0,0 +1,113 @@
+# ttl_cache.py
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def snapshot_key(*parts):
+    """Stable hash of JSON-serialisable parts, e.g. (snapshot, year, prompt version)"""
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """
+    In-memory cache whose entries expire ttl seconds after being stored, or
+    with sliding=True ttl seconds after they were last read or stored.
+    Beyond max_entries the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, sliding=False, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sliding = sliding
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or once it has expired"""
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                    self.expirations += 1
+                self.misses += 1
+                return None
+            if self.sliding:
+                self._entries[key] = (now + self.ttl, entry[1])
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > self.clock()
+
+    def put(self, key, value):
+        """Store value under key and evict the least recently used entries over the limit"""
+        with self._lock:
+            now = self.clock()
+            self._purge(now)
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """Remove key, returning its value if it was present and live"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry is not None and entry[0] > self.clock() else None
+
+    def _purge(self, now):
+        while self._entries:
+            key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[key]
+            self.expirations += 1
+
+    def purge(self):
+        """
+        Drop expired entries from the least recently used end. With sliding
+        expiry that order is also expiry order, so every expired entry goes.
+        """
+        with self._lock:
+            self._purge(self.clock())
+
+    def keys(self):
+        """Keys of the live entries, least recently used first"""
+        with self._lock:
+            now = self.clock()
+            return [key for key, (expires, _) in self._entries.items() if expires > now]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return size and hit/miss/eviction counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
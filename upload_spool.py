@@ -0,0 +1,244 @@
+# upload_spool.py
+
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import oss2
+
+from log_utils import get_logger, log_event
+
+logger = get_logger(__name__)
+
+RECEIPT_SPOOL_DIR = os.getenv('RECEIPT_SPOOL_DIR', os.path.join('data', 'spool'))
+SPOOL_WORKERS = int(os.getenv('RECEIPT_SPOOL_WORKERS', '4'))
+# Jobs handed to the workers per drain pass
+SPOOL_BATCH_SIZE = int(os.getenv('RECEIPT_SPOOL_BATCH_SIZE', '16'))
+SPOOL_MAX_ATTEMPTS = int(os.getenv('RECEIPT_SPOOL_MAX_ATTEMPTS', '10'))
+SPOOL_BACKOFF_BASE = float(os.getenv('RECEIPT_SPOOL_BACKOFF_BASE', '2'))
+SPOOL_BACKOFF_MAX = float(os.getenv('RECEIPT_SPOOL_BACKOFF_MAX', '300'))
+
+# Errors retrying cannot fix: bad credentials or bucket, or a lost spooled image
+PERMANENT_ERRORS = (
+    oss2.exceptions.AccessDenied,
+    oss2.exceptions.NoSuchBucket,
+    oss2.exceptions.InvalidArgument,
+    FileNotFoundError,
+    ValueError,
+)
+
+
+def _write_atomic(path, data):
+    """Write bytes so that path either holds all of data or does not exist"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class UploadSpool:
+    """
+    Durable write-behind queue for confirmed receipts.
+
+    enqueue() copies the image and writes a job record into pending/ and
+    returns; a background thread drains due jobs in batches through
+    `uploader(image_path, receipt_data, user_id=..., receipt_id=...,
+    uploaded_at=...)`, retrying failures with exponential backoff. Jobs
+    that fail permanently, or too often, are moved to failed/ and handed to
+    `on_give_up(job)`, if given. Pending jobs
+    survive restarts and are picked up by start(), so uploads are
+    at-least-once and the uploader must be idempotent per receipt_id.
+    """
+
+    def __init__(self, uploader, directory=RECEIPT_SPOOL_DIR, workers=SPOOL_WORKERS,
+                 batch_size=SPOOL_BATCH_SIZE, max_attempts=SPOOL_MAX_ATTEMPTS,
+                 backoff_base=SPOOL_BACKOFF_BASE, backoff_max=SPOOL_BACKOFF_MAX, on_give_up=None):
+        self.uploader = uploader
+        self.on_give_up = on_give_up
+        self.pending_dir = os.path.join(directory, 'pending')
+        self.failed_dir = os.path.join(directory, 'failed')
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {"enqueued": 0, "uploaded": 0, "retried": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        # Set when new jobs arrive while a drain pass is running
+        self._dirty = False
+        self._idle = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self._executor = None
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    # --- Journal ---
+    def _job_path(self, receipt_id):
+        return os.path.join(self.pending_dir, f"{receipt_id}.json")
+
+    def _save_job(self, job):
+        _write_atomic(self._job_path(job["receipt_id"]), json.dumps(job).encode('utf-8'))
+
+    def _load_jobs(self):
+        jobs = []
+        for name in os.listdir(self.pending_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.pending_dir, name), 'r', encoding='utf-8') as f:
+                    jobs.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error("Unreadable spool job %s: %s", name, e)
+        return jobs
+
+    def _recover(self):
+        """Clear debris left by a crash mid-enqueue: temp files and images without a job"""
+        jobs = {name[:-5] for name in os.listdir(self.pending_dir) if name.endswith('.json')}
+        for name in os.listdir(self.pending_dir):
+            if name.endswith('.tmp') or (not name.endswith('.json') and name.split('.')[0] not in jobs):
+                os.remove(os.path.join(self.pending_dir, name))
+        if jobs:
+            logger.info("Recovered %d pending receipt upload(s) from %s", len(jobs), self.pending_dir)
+
+    def enqueue(self, file_path, receipt_data, user_id, receipt_id=None, uploaded_at=None):
+        """Durably queue a receipt for upload and return its receipt_id"""
+        receipt_id = receipt_id or str(uuid.uuid4())
+        uploaded_at = uploaded_at or datetime.now()
+        # Recovery must finish before this job's files appear, or it could take them for debris
+        self.start()
+
+        # The image lands first; the job record is the commit point
+        image_path = os.path.join(self.pending_dir, f"{receipt_id}{os.path.splitext(file_path)[1] or '.jpg'}")
+        with open(file_path, 'rb') as f:
+            _write_atomic(image_path, f.read())
+        self._save_job({
+            "receipt_id": receipt_id,
+            "user_id": user_id,
+            "uploaded_at": uploaded_at.isoformat(),
+            "image_path": image_path,
+            "receipt_data": receipt_data,
+            "attempts": 0,
+            "next_attempt": 0,
+            "last_error": None,
+        })
+        self._count("enqueued")
+        log_event(logger, "receipt.spool.enqueued", receipt_id=receipt_id)
+
+        with self._wakeup:
+            self._dirty = True
+            self._idle.clear()
+            self._wakeup.notify()
+        return receipt_id
+
+    def pending_count(self):
+        if not os.path.isdir(self.pending_dir):
+            return 0
+        return sum(1 for name in os.listdir(self.pending_dir) if name.endswith('.json'))
+
+    # --- Draining ---
+    def _upload(self, job):
+        try:
+            self.uploader(job["image_path"], job["receipt_data"], user_id=job["user_id"],
+                          receipt_id=job["receipt_id"], uploaded_at=datetime.fromisoformat(job["uploaded_at"]))
+        except Exception as e:
+            self._failed_attempt(job, e)
+            return
+        os.remove(self._job_path(job["receipt_id"]))
+        os.remove(job["image_path"])
+        self._count("uploaded")
+        log_event(logger, "receipt.spool.uploaded", receipt_id=job["receipt_id"], attempts=job["attempts"] + 1)
+
+    def _failed_attempt(self, job, error):
+        job["attempts"] += 1
+        job["last_error"] = f"{type(error).__name__}: {error}"
+        if isinstance(error, PERMANENT_ERRORS) or job["attempts"] >= self.max_attempts:
+            os.makedirs(self.failed_dir, exist_ok=True)
+            _write_atomic(os.path.join(self.failed_dir, f"{job['receipt_id']}.json"), json.dumps(job).encode('utf-8'))
+            if os.path.exists(job["image_path"]):
+                shutil.move(job["image_path"], self.failed_dir)
+            os.remove(self._job_path(job["receipt_id"]))
+            self._count("failed")
+            logger.error("Giving up on receipt upload %s after %d attempt(s): %s",
+                         job["receipt_id"], job["attempts"], job["last_error"])
+            if self.on_give_up is not None:
+                try:
+                    self.on_give_up(job)
+                except Exception:
+                    logger.exception("Give-up handler failed for receipt %s", job["receipt_id"])
+            return
+        # Full jitter, so a recovering OSS is not hit by every job at once
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (job["attempts"] - 1)))
+        job["next_attempt"] = time.time() + delay
+        self._save_job(job)
+        self._count("retried")
+        logger.warning("Receipt upload %s failed (attempt %d), retrying in %.1fs: %s",
+                       job["receipt_id"], job["attempts"], delay, job["last_error"])
+
+    def drain_once(self):
+        """Upload one batch of due jobs; return seconds until the next job is due, or None"""
+        jobs = sorted(self._load_jobs(), key=lambda job: (job["next_attempt"], job["uploaded_at"]))
+        now = time.time()
+        due = [job for job in jobs if job["next_attempt"] <= now][:self.batch_size]
+        if due:
+            list(self._executor.map(self._upload, due))
+            return 0
+        if jobs:
+            return max(0.0, jobs[0]["next_attempt"] - now)
+        return None
+
+    def _run(self):
+        while not self._stopping:
+            with self._wakeup:
+                self._dirty = False
+            try:
+                wait = self.drain_once()
+            except Exception:
+                logger.exception("Receipt spool drain failed")
+                wait = self.backoff_base
+            if wait == 0:
+                continue
+            with self._wakeup:
+                if self._dirty or self._stopping:
+                    continue
+                if wait is None:
+                    self._idle.set()
+                self._wakeup.wait(wait)
+
+    def start(self):
+        """Recover the journal and start the background uploader (idempotent)"""
+        with self._wakeup:
+            if self._thread is not None:
+                return
+            os.makedirs(self.pending_dir, exist_ok=True)
+            self._recover()
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="receipt-spool")
+            self._thread = threading.Thread(target=self._run, name="receipt-spool", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout=None):
+        """Wait until every queued job is uploaded or given up on; False on timeout"""
+        if self._thread is None:
+            return self.pending_count() == 0
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._executor.shutdown()
+            self._thread = None